@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""Measure latency of database searches used by the API views depending on the number of rows.
+
+On PostgreSQL (BENCHMARK_DB_ENGINE=django.db.backends.postgresql and BENCHMARK_DB_NAME/USER/PASSWORD/HOST) compares
+plain `icontains` filters before and after creating the trigram indexes, and the similarity ranked search.
+
+Usage: python -m benchmarks.db_search [NDCS_COUNT ...]
+"""
+import sys
+import time
+
+from benchmarks.utils import create_dataset, setup_django
+
+QUERIES = ("drug 00", "substance 12", "labeler 4", "ug 0001")
+REPEAT = 20
+# trigram indexes created by the migrations
+TRIGRAM_INDEXES = (
+    ("fdadb_medicationname", "name"),
+    ("fdadb_medicationstrength", "strength_search"),
+    ("fdadb_medicationndc", "manufacturer"),
+)
+
+
+def timed(queryset_factory):
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        for q in QUERIES:
+            list(queryset_factory(q)[:10])
+    return (time.perf_counter() - start) / REPEAT / len(QUERIES) * 1000
+
+
+def run_queries(label):
+    from fdadb.db_search import search_queryset
+    from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+
+    searched_fields = (
+        (MedicationName, "name"),
+        (MedicationStrength, "strength_search"),
+        (MedicationNDC, "manufacturer"),
+    )
+    for model, field in searched_fields:
+        icontains = timed(lambda q: model.objects.filter(**{"{}__icontains".format(field): q}))
+        ranked = timed(lambda q: search_queryset(model.objects.all(), field, q))
+        print(
+            "{:<22} {:<16} icontains {:>8.2f} ms   search_queryset {:>8.2f} ms".format(label, field, icontains, ranked)
+        )
+
+
+def main(counts):
+    setup_django()
+
+    from django.db import connection
+
+    from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+
+    for count in counts:
+        for model in (MedicationNDC, MedicationStrength, MedicationName):
+            model.objects.all()._raw_delete(model.objects.db)
+        create_dataset(count)
+
+        if connection.vendor == "postgresql":
+            with connection.cursor() as cursor:
+                for table, column in TRIGRAM_INDEXES:
+                    cursor.execute('DROP INDEX IF EXISTS "{}_{}_trgm"'.format(table, column))
+            run_queries("{} NDCs, no index".format(count))
+            with connection.cursor() as cursor:
+                for table, column in TRIGRAM_INDEXES:
+                    cursor.execute(
+                        'CREATE INDEX "{table}_{column}_trgm" ON "{table}" '
+                        'USING gin (UPPER("{column}"::text) gin_trgm_ops)'.format(table=table, column=column)
+                    )
+                cursor.execute("ANALYZE")
+        run_queries("{} NDCs".format(count))
+
+
+if __name__ == "__main__":
+    main([int(count) for count in sys.argv[1:]] or [1000, 10000, 100000])
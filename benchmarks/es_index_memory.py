@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Compare memory used to build ElasticSearch documents from model instances and from streamed values() rows.
+
+Usage: python -m benchmarks.es_index_memory [NDCS_COUNT]
+"""
+import sys
+from collections import deque
+
+from benchmarks.utils import create_dataset, measure, setup_django
+
+
+def build_documents_from_instances():
+    # documents built the way index_medications did before streaming values() rows
+    from fdadb.es_search import EsSearchAPI
+    from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+
+    names = [
+        {"name": medication_name.name, "active_substances": medication_name.active_substances}
+        for medication_name in MedicationName.objects.all()
+    ][-1:]
+    strengths = [
+        {
+            "name": medication_strength.medication_name.name,
+            "active_substances": medication_strength.medication_name.active_substances,
+            "strength": medication_strength.strength,
+            "strength_search_string": EsSearchAPI._get_strength_search_string(medication_strength.strength),
+        }
+        for medication_strength in MedicationStrength.objects.select_related("medication_name").all()
+    ][-1:]
+    queryset = MedicationNDC.objects.select_related("medication_strength", "medication_strength__medication_name")
+    ndcs = [
+        {
+            "name": medication_ndc.medication_strength.medication_name.name,
+            "active_substances": medication_ndc.medication_strength.medication_name.active_substances,
+            "strength": medication_ndc.medication_strength.strength,
+            "strength_id": medication_ndc.medication_strength_id,
+            "ndc": medication_ndc.ndc,
+            "manufacturer": medication_ndc.manufacturer,
+        }
+        # iterating the queryset fills its result cache with all the model instances
+        for medication_ndc in queryset.all()
+    ][-1:]
+    return names, strengths, ndcs
+
+
+def build_documents_from_rows():
+    from fdadb.es_search import EsSearchAPI
+    from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+
+    es_search = EsSearchAPI.__new__(EsSearchAPI)
+    actions = es_search._get_index_actions(
+        MedicationName.objects.all(),
+        MedicationStrength.objects.all(),
+        MedicationNDC.objects.all(),
+        {"fda_medications_names": "names", "fda_medications_strengths": "strengths", "fda_medications_ndcs": "ndcs"},
+    )
+    for index, index_actions in actions:
+        deque(index_actions, maxlen=1)
+
+
+def main(ndcs_count):
+    setup_django()
+    print("creating {} NDCs...".format(ndcs_count))
+    create_dataset(ndcs_count)
+
+    with measure("model instances"):
+        build_documents_from_instances()
+    with measure("values() rows with iterator()"):
+        build_documents_from_rows()
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 500000)
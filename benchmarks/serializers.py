@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""Measure the cost of serializing and rendering 1,000 rows of each list API.
+
+Compares model serializers of model instances (as loaded by the views by default), fast serializers of `values()` rows
+and ElasticSearch documents, and the default and orjson JSON renderers.
+
+Usage: python -m benchmarks.serializers [ROWS]
+"""
+import json
+import sys
+import time
+
+from benchmarks.utils import create_dataset, setup_django
+
+REPEAT = 20
+
+
+def timed(function):
+    function()
+    start = time.perf_counter()
+    for i in range(REPEAT):
+        function()
+    return (time.perf_counter() - start) / REPEAT * 1000
+
+
+def es_documents(rows):
+    """ElasticSearch documents of the rows, as returned by EsSearchAPI"""
+    documents = []
+    for row in rows:
+        document = dict(row)
+        for key in ("strength", "active_substances"):
+            if key in document:
+                document[key] = json.loads(json.dumps(document[key]))
+        documents.append(document)
+    return documents
+
+
+def main(rows_count):
+    setup_django()
+
+    from rest_framework.renderers import JSONRenderer
+
+    from fdadb.api import MedicationNamesListAPI, MedicationNDCsListAPI, MedicationStrengthsListAPI
+    from fdadb.renderers import ORJSONRenderer, orjson
+
+    create_dataset(rows_count * 20)
+
+    print("per {} rows".format(rows_count))
+    for view_class in (MedicationNamesListAPI, MedicationStrengthsListAPI, MedicationNDCsListAPI):
+        view = view_class()
+        queryset = view.queryset.all()[:rows_count]
+        instances = list(queryset)
+        rows = list(queryset.values(*view.values_fields, **view.values_expressions))
+        documents = es_documents(rows)
+
+        model_serializer = timed(lambda: view.serializer_class(instances, many=True).data)
+        fast_serializer = timed(lambda: view.fast_serializer_class(rows, many=True).data)
+        fast_documents = timed(lambda: view.fast_serializer_class(documents, many=True).data)
+        print(
+            "{:<18} ModelSerializer {:>8.2f} ms   fast (values) {:>8.2f} ms   fast (ES documents) {:>8.2f} ms".format(
+                view.queryset.model.__name__, model_serializer, fast_serializer, fast_documents
+            )
+        )
+
+        data = view.fast_serializer_class(rows, many=True).data
+        json_renderer = timed(lambda: JSONRenderer().render(data))
+        if orjson is not None:
+            print(
+                "{:<18} JSONRenderer    {:>8.2f} ms   ORJSONRenderer {:>7.2f} ms".format(
+                    "", json_renderer, timed(lambda: ORJSONRenderer().render(data))
+                )
+            )
+        else:
+            print("{:<18} JSONRenderer    {:>8.2f} ms   (orjson is not installed)".format("", json_renderer))
+
+
+if __name__ == "__main__":
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Helpers shared by the benchmarks, run them from the repository root, e.g.: python -m benchmarks.es_index_memory"""
+import os
+import sys
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.realpath(__file__))))
+
+
+def setup_django(**extra_settings):
+    import django
+    from django.conf import settings
+
+    settings.configure(
+        DATABASES={
+            "default": {
+                "ENGINE": os.environ.get("BENCHMARK_DB_ENGINE", "django.db.backends.sqlite3"),
+                "NAME": os.environ.get("BENCHMARK_DB_NAME", ":memory:"),
+                "USER": os.environ.get("BENCHMARK_DB_USER", ""),
+                "PASSWORD": os.environ.get("BENCHMARK_DB_PASSWORD", ""),
+                "HOST": os.environ.get("BENCHMARK_DB_HOST", ""),
+            }
+        },
+        INSTALLED_APPS=(
+            "django.contrib.auth",
+            "django.contrib.contenttypes",
+            "django.contrib.admin",
+            "rest_framework",
+            "fdadb",
+        ),
+        SECRET_KEY="not very secret in benchmarks",
+        USE_TZ=True,
+        ROOT_URLCONF="fdadb.api_urls",
+        **extra_settings
+    )
+    django.setup()
+
+    from django.core.management import call_command
+
+    call_command("migrate", "fdadb", verbosity=0)
+
+
+def create_dataset(ndcs_count, ndcs_per_strength=5, strengths_per_name=4):
+    """Create a synthetic dataset with given number of NDCs"""
+    from fdadb.models import (MedicationName, MedicationNDC, MedicationStrength, get_strength_hash,
+                              get_strength_search_string)
+
+    def get_strength(i):
+        return {
+            "Substance {} A".format(i // strengths_per_name): {"strength": str(i % 100), "unit": "mg/1"},
+            "Substance B": {"strength": "10", "unit": "mg/mL"},
+        }
+
+    strengths_count = -(-ndcs_count // ndcs_per_strength)
+    names_count = -(-strengths_count // strengths_per_name)
+    MedicationName.objects.bulk_create(
+        (
+            MedicationName(name="Drug {:07d}".format(i), active_substances=["Substance {} A".format(i), "Substance B"])
+            for i in range(names_count)
+        ),
+        batch_size=1000,
+    )
+    MedicationStrength.objects.bulk_create(
+        (
+            MedicationStrength(
+                medication_name_id="Drug {:07d}".format(i // strengths_per_name),
+                strength=get_strength(i),
+                strength_search=get_strength_search_string(get_strength(i)),
+                strength_hash=get_strength_hash(get_strength(i)),
+            )
+            for i in range(strengths_count)
+        ),
+        batch_size=1000,
+    )
+    strength_ids = list(MedicationStrength.objects.order_by("pk").values_list("pk", flat=True))
+    MedicationNDC.objects.bulk_create(
+        (
+            MedicationNDC(
+                medication_strength_id=strength_ids[i // ndcs_per_strength],
+                ndc="{:05d}-{:04d}".format(i // 10000, i % 10000),
+                manufacturer="Labeler {}".format(i % 500),
+            )
+            for i in range(ndcs_count)
+        ),
+        batch_size=1000,
+    )
+
+
+@contextmanager
+def measure(label):
+    """Print time and peak memory allocated by the code in the block"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        current, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+        print("{:<40} {:>10.2f} s {:>10.1f} MiB peak".format(label, elapsed, peak / 1024 / 1024))
@@ -1,19 +1,139 @@
 # -*- coding: utf-8 -*-
+import hashlib
+from collections import OrderedDict
+
 from django.conf import settings
+from django.db.models import F, Q, QuerySet
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.decorators import method_decorator
+from django.utils.http import urlencode
+from django.views.decorators.http import condition
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import LimitOffsetPagination, PageNumberPagination
 from rest_framework.permissions import AllowAny
+from rest_framework.renderers import JSONRenderer
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.views import APIView
 
-from fdadb.es_search import EsSearchAPI
+from fdadb.cache import autocomplete_cache, get_data_version_info, response_cache
+from fdadb.db_search import get_search_filter, search_many, search_queryset
+from fdadb.es_search import EsSearchAPI, is_es_enabled
 from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
-from fdadb.serializers import MedicationNameSerializer, MedicationNDCSerializer, MedicationStrengthSerializer
+from fdadb.pagination import (ES_MAX_RESULT_WINDOW, EsLimitOffsetPagination, EsPageNumberPagination, EsSearchResults,
+                              KeysetPagination, NameKeysetPagination)
+from fdadb.prefix_search import search_names
+from fdadb.renderers import ORJSONRenderer, orjson
+from fdadb.serializers import (BatchSearchSerializer, FastMedicationNameSerializer, FastMedicationNDCSerializer,
+                               FastMedicationStrengthSerializer, MedicationNameSerializer, MedicationNDCSerializer,
+                               MedicationStrengthSerializer)
 
 AUTOCOMPLETE_LIMIT = getattr(settings, "FDADB_AUTOCOMPLETE_LIMIT", 10)
+# backend used to search medication names when ElasticSearch is disabled: "database" or "memory"
+NAME_SEARCH_BACKEND = getattr(settings, "FDADB_NAME_SEARCH_BACKEND", "database")
+# paginate database querysets with cursors instead of page numbers and offsets
+CURSOR_PAGINATION = getattr(settings, "FDADB_CURSOR_PAGINATION", False)
+# serialize values() rows and ElasticSearch documents with read-only serializers instead of model serializers
+FAST_SERIALIZERS = getattr(settings, "FDADB_FAST_SERIALIZERS", False)
+# render JSON with orjson when it is installed
+ORJSON_RENDERER = getattr(settings, "FDADB_ORJSON_RENDERER", False)
+# max-age of the Cache-Control header, clients revalidate responses with their ETag after it
+CACHE_CONTROL_MAX_AGE = getattr(settings, "FDADB_CACHE_CONTROL_MAX_AGE", 0)
+
+
+def get_query_params(request):
+    return urlencode(sorted(request.GET.lists()), doseq=True)
+
+
+def make_etag(version, request):
+    """Return the ETag of a response: the data version, the path, the sorted query params and the accepted types"""
+    key = "\n".join((version, request.path, get_query_params(request), request.META.get("HTTP_ACCEPT", "")))
+    return hashlib.sha1(key.encode("utf-8")).hexdigest()
+
+
+def get_etag(request, *args, **kwargs):
+    version, updated = get_data_version_info()
+    return make_etag(version, request)
+
+
+def get_last_modified(request, *args, **kwargs):
+    version, updated = get_data_version_info()
+    return updated
+
+
+def patch_cache_headers(response):
+    patch_cache_control(response, public=True, max_age=CACHE_CONTROL_MAX_AGE)
+    patch_vary_headers(response, ("Accept",))
 
 
 class SearchMixin(object):
+    cursor_pagination_class = KeysetPagination
+    fast_serializer_class = None
+    # arguments of values() giving rows for the fast serializer
+    values_fields = ()
+    values_expressions = {}
+    # None uses FDADB_FAST_SERIALIZERS and FDADB_ORJSON_RENDERER
+    fast_serialization = None
+    orjson_renderer = None
+    # default window of ElasticSearch results
+    es_results_size = 10
+
+    def use_fast_serializer(self):
+        fast_serialization = FAST_SERIALIZERS if self.fast_serialization is None else self.fast_serialization
+        return fast_serialization and self.fast_serializer_class is not None
+
+    def get_serializer_class(self):
+        if self.use_fast_serializer():
+            return self.fast_serializer_class
+        return super().get_serializer_class()
+
+    def get_rows(self, queryset):
+        """Return `values()` rows of the queryset when the fast serializer is used"""
+        if self.use_fast_serializer():
+            return queryset.values(*self.values_fields, **self.values_expressions)
+        return queryset
+
+    def get_renderers(self):
+        renderers = super().get_renderers()
+        use_orjson = ORJSON_RENDERER if self.orjson_renderer is None else self.orjson_renderer
+        if use_orjson and orjson is not None:
+            renderers = [ORJSONRenderer() if type(renderer) is JSONRenderer else renderer for renderer in renderers]
+        return renderers
+
+    def paginate_queryset(self, queryset):
+        if CURSOR_PAGINATION and isinstance(queryset, QuerySet):
+            self._paginator = self.cursor_pagination_class()
+        return super().paginate_queryset(queryset)
+
+    @method_decorator(condition(etag_func=get_etag, last_modified_func=get_last_modified))
+    def get(self, request, *args, **kwargs):
+        # conditional requests are answered with 304 before querying the database or ElasticSearch
+        return super().get(request, *args, **kwargs)
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(request, response, *args, **kwargs)
+        if request.method in ("GET", "HEAD") and response.status_code in (200, 304):
+            patch_cache_headers(response)
+        return response
+
+    def get_es_search(self, es, q):
+        """Return the search of ElasticSearch results, called with offset and size; `es` is an EsSearchAPI or an
+        AsyncEsSearchAPI"""
+        raise NotImplementedError
+
+    def get_db_queryset(self, q):
+        """Return the queryset of database results"""
+        raise NotImplementedError
+
+    def get_es_max_size(self, q):
+        """Return the most ElasticSearch results listed when the results are not paginated"""
+        return ES_MAX_RESULT_WINDOW
+
+    def get_filter(self):
+        """Return the filter of database results by the URL kwargs, the query searches `search_field` in them"""
+        return Q()
+
     def get_q_and_es_enabled(self):
-        es_enabled = bool(getattr(settings, "ELASTICSEARCH_URL", None) and not getattr(settings, "TESTING", False))
+        es_enabled = is_es_enabled()
         q = None
         if hasattr(self, "request"):
             if "q" in self.request.GET:
@@ -21,59 +141,168 @@ class SearchMixin(object):
         return q, es_enabled
 
 
-class MedicationNamesListAPI(ListAPIView, SearchMixin):
+class ResponseCacheMixin(object):
+    """Serve responses from the response cache (FDADB_RESPONSE_CACHE_BACKEND)"""
+
+    def list(self, request, *args, **kwargs):
+        def compute():
+            return super(ResponseCacheMixin, self).list(request, *args, **kwargs).data
+
+        return Response(response_cache.get_or_set(request.path, get_query_params(request), compute))
+
+
+class MedicationNamesListAPI(SearchMixin, ListAPIView):
     permission_classes = (AllowAny,)
-    # for now list of autocomplete results will be limited, so no pagination is needed
-    # TODO: add ES pagination
-    pagination_class = LimitOffsetPagination
+    pagination_class = EsLimitOffsetPagination
+    cursor_pagination_class = NameKeysetPagination
     queryset = MedicationName.objects.all()
     serializer_class = MedicationNameSerializer
+    fast_serializer_class = FastMedicationNameSerializer
+    values_fields = ("name", "active_substances")
     ordering = ("name",)
+    es_results_size = AUTOCOMPLETE_LIMIT
+    search_field = "name"
+
+    def get_es_search(self, es, q):
+        return lambda offset, size: es.search_name(q, size, offset=offset)
+
+    def get_es_max_size(self, q):
+        # like the database search, unpaginated autocomplete lists at most AUTOCOMPLETE_LIMIT names
+        return AUTOCOMPLETE_LIMIT if q else super().get_es_max_size(q)
+
+    def get_db_queryset(self, q):
+        queryset = super().get_queryset()
+        if q:
+            return self.get_rows(search_queryset(queryset, self.search_field, q))[:AUTOCOMPLETE_LIMIT]
+        return self.get_rows(queryset)
 
     def get_queryset(self):
         q, es_enabled = self.get_q_and_es_enabled()
         if es_enabled:
-            count, objects_list = EsSearchAPI().search_name(q, AUTOCOMPLETE_LIMIT)
-            return objects_list
+            return EsSearchResults(
+                self.get_es_search(EsSearchAPI(), q), size=self.es_results_size, max_size=self.get_es_max_size(q)
+            )
         else:
-            queryset = super().get_queryset()
+            if q and NAME_SEARCH_BACKEND == "memory":
+                return autocomplete_cache.get_or_set(
+                    "memory", q, AUTOCOMPLETE_LIMIT, lambda: search_names(q, AUTOCOMPLETE_LIMIT)
+                )
             if q:
-                queryset = queryset.filter(name__icontains=q)[:AUTOCOMPLETE_LIMIT]
-            return queryset
+                return autocomplete_cache.get_or_set("db", q, AUTOCOMPLETE_LIMIT, lambda: list(self.get_db_queryset(q)))
+            return self.get_db_queryset(q)
 
 
-class MedicationStrengthsListAPI(ListAPIView, SearchMixin):
-    # TODO: add filtering and use ES for the queryset (with pagination)
+class MedicationStrengthsListAPI(ResponseCacheMixin, SearchMixin, ListAPIView):
     permission_classes = (AllowAny,)
-    pagination_class = PageNumberPagination
-    queryset = MedicationStrength.objects.all()
+    pagination_class = EsPageNumberPagination
+    queryset = MedicationStrength.objects.select_related("medication_name").order_by("id")
     serializer_class = MedicationStrengthSerializer
+    fast_serializer_class = FastMedicationStrengthSerializer
+    values_fields = ("id", "strength")
+    values_expressions = {"name": F("medication_name_id"), "active_substances": F("medication_name__active_substances")}
     ordering = ("id",)
+    search_field = "strength_search"
+
+    def get_es_search(self, es, q):
+        return lambda offset, size: es.search_strength(self.kwargs["medication_name"], q, size=size, offset=offset)
+
+    def get_filter(self):
+        return Q(medication_name__name=self.kwargs["medication_name"])
+
+    def get_db_queryset(self, q):
+        queryset = super().get_queryset().filter(self.get_filter())
+        if q:
+            queryset = search_queryset(queryset, self.search_field, q)
+        return self.get_rows(queryset)
 
     def get_queryset(self):
         q, es_enabled = self.get_q_and_es_enabled()
-        queryset = super().get_queryset().filter(medication_name__name=self.kwargs["medication_name"])
-        if q:
-            queryset = queryset.filter(strength__icontains=q)
-        return queryset
+        if es_enabled:
+            return EsSearchResults(self.get_es_search(EsSearchAPI(), q), size=self.es_results_size)
+        return self.get_db_queryset(q)
 
 
-class MedicationNDCsListAPI(ListAPIView, SearchMixin):
-    # TODO: add filtering and use ES for the queryset (with pagination)
+class MedicationNDCsListAPI(ResponseCacheMixin, SearchMixin, ListAPIView):
     permission_classes = (AllowAny,)
-    pagination_class = PageNumberPagination
-    queryset = MedicationNDC.objects.all()
+    pagination_class = EsPageNumberPagination
+    queryset = MedicationNDC.objects.select_related("medication_strength__medication_name").order_by("id")
     serializer_class = MedicationNDCSerializer
+    fast_serializer_class = FastMedicationNDCSerializer
+    values_fields = ("id", "ndc", "manufacturer")
+    values_expressions = {
+        "name": F("medication_strength__medication_name_id"),
+        "active_substances": F("medication_strength__medication_name__active_substances"),
+        "strength": F("medication_strength__strength"),
+    }
     ordering = ("id",)
+    search_field = "manufacturer"
 
-    def get_queryset(self):
-        q, es_enabled = self.get_q_and_es_enabled()
-        queryset = super().get_queryset()
-        queryset = queryset.filter(
+    def get_es_search(self, es, q):
+        return lambda offset, size: es.search_ndc(
+            self.kwargs["medication_name"], self.kwargs["strength_id"], q, size=size, offset=offset
+        )
+
+    def get_filter(self):
+        return Q(
             medication_strength__medication_name__name=self.kwargs["medication_name"],
             medication_strength_id=self.kwargs["strength_id"],
         )
 
+    def get_db_queryset(self, q):
+        queryset = super().get_queryset().filter(self.get_filter())
         if q:
-            queryset = queryset.filter(manufacturer__icontains=q)
-        return queryset
+            queryset = search_queryset(queryset, self.search_field, q)
+        return self.get_rows(queryset)
+
+    def get_queryset(self):
+        q, es_enabled = self.get_q_and_es_enabled()
+        if es_enabled:
+            return EsSearchResults(self.get_es_search(EsSearchAPI(), q), size=self.es_results_size)
+        return self.get_db_queryset(q)
+
+
+class MedicationsBatchSearchAPI(APIView):
+    """Searches of names, strengths and NDCs sent at once, in a single ElasticSearch or database round trip"""
+
+    permission_classes = (AllowAny,)
+    search_views = OrderedDict(
+        (("name", MedicationNamesListAPI), ("strength", MedicationStrengthsListAPI), ("ndc", MedicationNDCsListAPI))
+    )
+
+    def get_search_view(self, query):
+        """Return the list API of the query, giving its filters, rows and serializer"""
+        kwargs = {"medication_name": query.get("name"), "strength_id": query.get("strength_id")}
+        return self.search_views[query["type"]](request=self.request, args=(), kwargs=kwargs, format_kwarg=None)
+
+    def post(self, request, *args, **kwargs):
+        serializer = BatchSearchSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        queries = serializer.validated_data["queries"]
+        for query in queries:
+            query.setdefault("size", AUTOCOMPLETE_LIMIT if query["type"] == "name" else api_settings.PAGE_SIZE or 10)
+
+        views = [self.get_search_view(query) for query in queries]
+        if is_es_enabled():
+            results = EsSearchAPI().search_many(queries)
+        else:
+            results = self.search_database(queries, views)
+        return Response(
+            {"results": [view.get_serializer(items, many=True).data for view, items in zip(views, results)]}
+        )
+
+    def search_database(self, queries, views):
+        """Return results of the queries with a single database query for each type of queries"""
+        results = [None] * len(queries)
+        for search_type, view_class in self.search_views.items():
+            indexes = [i for i, query in enumerate(queries) if query["type"] == search_type]
+            if not indexes:
+                continue
+
+            view = views[indexes[0]]
+            searches = [
+                (views[i].get_filter() & get_search_filter(view.search_field, queries[i].get("q")), queries[i]["size"])
+                for i in indexes
+            ]
+            for i, rows in zip(indexes, search_many(view.get_rows(view.queryset.all()), searches, view.ordering)):
+                results[i] = rows
+        return results
@@ -1,9 +1,11 @@
 # -*- coding: utf-8 -*-
 from django.urls import re_path as url
 
-from fdadb.api import MedicationNamesListAPI, MedicationNDCsListAPI, MedicationStrengthsListAPI
+from fdadb.api import (MedicationNamesListAPI, MedicationNDCsListAPI, MedicationsBatchSearchAPI,
+                       MedicationStrengthsListAPI)
 
 urlpatterns = [
+    url(r"^medications/batch$", MedicationsBatchSearchAPI.as_view(), name="fdadb-medications-batch"),
     url(r"^medications$", MedicationNamesListAPI.as_view(), name="fdadb-medications-names"),
     url(
         r"^medications/(?P<medication_name>[\w-]+)/strengths$",
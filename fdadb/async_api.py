@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse
+from django.utils.cache import get_conditional_response, quote_etag
+from django.utils.http import http_date
+from django.views import View
+from rest_framework.exceptions import APIException
+
+from fdadb import api
+from fdadb.cache import aget_data_version_info, autocomplete_cache
+from fdadb.es_search import AsyncEsSearchAPI
+from fdadb.pagination import EsSearchResults
+from fdadb.prefix_search import search_names
+
+
+class FetchRequired(Exception):
+    """Raised by prefetched results when the paginator needs a window that was not fetched yet"""
+
+    def __init__(self, offset, size):
+        super().__init__(offset, size)
+        self.offset, self.size = offset, size
+
+
+async def paginate(paginator, request, view, search, **kwargs):
+    """Paginate results of the async `search` (called with offset and size) with a paginator of the sync views.
+
+    Return the page (all results when there is no page size) and whether the results are paginated. Keyword arguments
+    are passed to EsSearchResults.
+
+    The paginator is run on results fetched in advance; when it asks for another window (e.g. the last page once the
+    count is known), the window is fetched and the pagination is run again.
+    """
+    fetched = {}
+
+    def fetch(offset, size):
+        try:
+            return fetched[offset, size]
+        except KeyError:
+            raise FetchRequired(offset, size)
+
+    while True:
+        results = EsSearchResults(fetch, **kwargs)
+        try:
+            page = paginator.paginate_queryset(results, request, view)
+            if page is None:
+                return list(results), False
+            return page, True
+        except FetchRequired as e:
+            fetched[e.offset, e.size] = await search(e.offset, e.size)
+
+
+async def search_queryset_page(queryset, offset, size):
+    """Return the count and a page of the queryset with the async ORM"""
+    return await queryset.acount(), [row async for row in queryset[offset:offset + size]]
+
+
+class AsyncListAPI(View):
+    """Async variant of a list API: the queries, serializer and pagination of `api_class`, sent with AsyncElasticsearch
+    and the async ORM.
+
+    Requests are not authenticated (the APIs allow anyone) and responses are not stored in the response cache.
+    """
+
+    api_class = None
+
+    def get_api(self, request, *args, **kwargs):
+        view = self.api_class(args=args, kwargs=kwargs, format_kwarg=None)
+        view.request = view.initialize_request(request, *args, **kwargs)
+        return view
+
+    async def get(self, request, *args, **kwargs):
+        version, updated = await aget_data_version_info()
+        etag, last_modified = quote_etag(api.make_etag(version, request)), int(updated.timestamp())
+        # conditional requests are answered with 304 before querying the database or ElasticSearch
+        response = get_conditional_response(request, etag=etag, last_modified=last_modified)
+        if response is None:
+            response = await self.get_list_response(self.get_api(request, *args, **kwargs))
+            response.headers.setdefault("ETag", etag)
+            response.headers.setdefault("Last-Modified", http_date(last_modified))
+        if response.status_code in (200, 304):
+            api.patch_cache_headers(response)
+        return response
+
+    async def get_list_response(self, view):
+        try:
+            q, es_enabled = view.get_q_and_es_enabled()
+            if es_enabled:
+                search = view.get_es_search(AsyncEsSearchAPI(), q)
+                kwargs = {"max_size": view.get_es_max_size(q)}
+            else:
+                search = await self.get_db_search(view, q)
+                # all database results are listed and paginated, like querysets of the sync views
+                kwargs = {"max_size": None, "max_window": None}
+            paginator = view.pagination_class()
+            page, paginated = await paginate(paginator, view.request, view, search, size=view.es_results_size, **kwargs)
+            data = view.get_serializer(page, many=True).data
+            if paginated:
+                data = paginator.get_paginated_response(data).data
+        except APIException as e:
+            return JsonResponse({"detail": e.detail}, status=e.status_code)
+
+        renderer = next(renderer for renderer in view.get_renderers() if renderer.format == "json")
+        return HttpResponse(renderer.render(data), content_type=renderer.media_type)
+
+    async def get_db_search(self, view, q):
+        """Return the async search of database results, called with offset and size"""
+        queryset = view.get_db_queryset(q)
+        return lambda offset, size: search_queryset_page(queryset, offset, size)
+
+
+class AsyncMedicationNamesListAPI(AsyncListAPI):
+    api_class = api.MedicationNamesListAPI
+
+    async def get_db_search(self, view, q):
+        if not q:
+            return await super().get_db_search(view, q)
+
+        if api.NAME_SEARCH_BACKEND == "memory":
+            names = await autocomplete_cache.aget_or_set(
+                "memory", q, api.AUTOCOMPLETE_LIMIT, lambda: sync_to_async(search_names)(q, api.AUTOCOMPLETE_LIMIT)
+            )
+        else:
+            queryset = view.get_db_queryset(q)
+
+            async def compute():
+                return [row async for row in queryset]
+
+            names = await autocomplete_cache.aget_or_set("db", q, api.AUTOCOMPLETE_LIMIT, compute)
+
+        async def search(offset, size):
+            return len(names), names[offset:offset + size]
+
+        return search
+
+
+class AsyncMedicationStrengthsListAPI(AsyncListAPI):
+    api_class = api.MedicationStrengthsListAPI
+
+
+class AsyncMedicationNDCsListAPI(AsyncListAPI):
+    api_class = api.MedicationNDCsListAPI
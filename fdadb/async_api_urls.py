@@ -0,0 +1,21 @@
+# -*- coding: utf-8 -*-
+from django.urls import re_path as url
+
+from fdadb.api import MedicationsBatchSearchAPI
+from fdadb.async_api import AsyncMedicationNamesListAPI, AsyncMedicationNDCsListAPI, AsyncMedicationStrengthsListAPI
+
+# the async variants of the APIs in fdadb.api_urls, with the same URL names (the batch search stays sync)
+urlpatterns = [
+    url(r"^medications/batch$", MedicationsBatchSearchAPI.as_view(), name="fdadb-medications-batch"),
+    url(r"^medications$", AsyncMedicationNamesListAPI.as_view(), name="fdadb-medications-names"),
+    url(
+        r"^medications/(?P<medication_name>[\w-]+)/strengths$",
+        AsyncMedicationStrengthsListAPI.as_view(),
+        name="fdadb-medications-strengths",
+    ),
+    url(
+        r"^medications/(?P<medication_name>[\w-]+)/strengths/(?P<strength_id>[\d-]+)/ndcs$",
+        AsyncMedicationNDCsListAPI.as_view(),
+        name="fdadb-medications-ndcs",
+    ),
+]
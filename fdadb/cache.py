@@ -0,0 +1,261 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+
+from fdadb.models import DataVersion
+
+# 0 disables the autocomplete cache
+AUTOCOMPLETE_CACHE_SIZE = getattr(settings, "FDADB_AUTOCOMPLETE_CACHE_SIZE", 1024)
+AUTOCOMPLETE_CACHE_TTL = getattr(settings, "FDADB_AUTOCOMPLETE_CACHE_TTL", 300)
+# alias of a Django cache used instead of the in-process cache (e.g. to share results between processes)
+AUTOCOMPLETE_CACHE_BACKEND = getattr(settings, "FDADB_AUTOCOMPLETE_CACHE_BACKEND", None)
+# alias of a Django cache storing responses of the strengths and NDCs APIs, None disables the response cache
+RESPONSE_CACHE_BACKEND = getattr(settings, "FDADB_RESPONSE_CACHE_BACKEND", None)
+RESPONSE_CACHE_TTL = getattr(settings, "FDADB_RESPONSE_CACHE_TTL", 300)
+# seconds other requests wait for a response being computed before computing it themselves
+RESPONSE_CACHE_LOCK_TIMEOUT = getattr(settings, "FDADB_RESPONSE_CACHE_LOCK_TIMEOUT", 10)
+DATA_VERSION_CACHE_KEY = "fdadb:data_version"
+# seconds the data version is cached for, processes not sharing the cache see a new version after this time
+DATA_VERSION_TTL = getattr(settings, "FDADB_DATA_VERSION_TTL", 60)
+
+
+def get_cache_backend():
+    return caches[AUTOCOMPLETE_CACHE_BACKEND or "default"]
+
+
+def new_data_version():
+    return uuid.uuid4().hex
+
+
+def load_data_version():
+    """Return the version of the medications data and the time it was changed, as stored in the database"""
+    data_version, created = DataVersion.objects.get_or_create(
+        pk=1, defaults={"version": new_data_version(), "updated": timezone.now()}
+    )
+    return data_version.version, data_version.updated
+
+
+def get_data_version_info():
+    """Return the version of the medications data and the time it was changed, changed after each import and reindex"""
+    return get_cache_backend().get_or_set(DATA_VERSION_CACHE_KEY, load_data_version, timeout=DATA_VERSION_TTL)
+
+
+def get_data_version():
+    return get_data_version_info()[0]
+
+
+async def aget_data_version_info():
+    """Async variant of get_data_version_info, for async views"""
+    cache = get_cache_backend()
+    data_version = await cache.aget(DATA_VERSION_CACHE_KEY)
+    if data_version is None:
+        version, created = await DataVersion.objects.aget_or_create(
+            pk=1, defaults={"version": new_data_version(), "updated": timezone.now()}
+        )
+        data_version = (version.version, version.updated)
+        await cache.aset(DATA_VERSION_CACHE_KEY, data_version, timeout=DATA_VERSION_TTL)
+    return data_version
+
+
+def bump_data_version():
+    """Store a new version of the medications data"""
+    version, updated = new_data_version(), timezone.now()
+    DataVersion.objects.update_or_create(pk=1, defaults={"version": version, "updated": updated})
+    get_cache_backend().set(DATA_VERSION_CACHE_KEY, (version, updated), timeout=DATA_VERSION_TTL)
+    return version, updated
+
+
+class LRUCache(object):
+    """Thread-safe, size-bounded cache with least recently used eviction and expiration of items"""
+
+    def __init__(self, max_size, ttl):
+        self.max_size = max_size
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires, value = self._items[key]
+            except KeyError:
+                return default
+            if expires < time.monotonic():
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+class AutocompleteCache(object):
+    """Cache of autocomplete results keyed on the normalised query, the limit and the data version"""
+
+    def __init__(
+        self, max_size=AUTOCOMPLETE_CACHE_SIZE, ttl=AUTOCOMPLETE_CACHE_TTL, backend=AUTOCOMPLETE_CACHE_BACKEND
+    ):
+        self.enabled = max_size > 0
+        self.ttl = ttl
+        self.backend = backend
+        self.local = LRUCache(max_size, ttl)
+        self.hits = self.misses = 0
+
+    @classmethod
+    def normalise_query(cls, q):
+        return " ".join((q or "").lower().split())
+
+    def make_key(self, source, q, limit, offset=0, version=None):
+        query_hash = hashlib.md5(self.normalise_query(q).encode("utf-8")).hexdigest()
+        return "fdadb:autocomplete:{}:{}:{}:{}:{}".format(
+            version or get_data_version(), source, limit, offset, query_hash
+        )
+
+    def get_or_set(self, source, q, limit, compute, offset=0):
+        """Return cached results of the query or compute and cache them"""
+        if not self.enabled:
+            return compute()
+
+        key = self.make_key(source, q, limit, offset)
+        cache = caches[self.backend] if self.backend else self.local
+        value = cache.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = compute()
+        if self.backend:
+            cache.set(key, value, timeout=self.ttl)
+        else:
+            cache.set(key, value)
+        return value
+
+    async def aget_or_set(self, source, q, limit, compute, offset=0):
+        """Async variant of get_or_set, `compute` returns an awaitable"""
+        if not self.enabled:
+            return await compute()
+
+        version, updated = await aget_data_version_info()
+        key = self.make_key(source, q, limit, offset, version=version)
+        value = await caches[self.backend].aget(key) if self.backend else self.local.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        value = await compute()
+        if self.backend:
+            await caches[self.backend].aset(key, value, timeout=self.ttl)
+        else:
+            self.local.set(key, value)
+        return value
+
+    def clear(self):
+        self.local.clear()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "size": len(self.local)}
+
+
+class ResponseCache(object):
+    """Cache of API responses in a Django cache, keyed on the request and the data version.
+
+    A missing response is computed by a single request at a time (across processes if the cache is shared), the other
+    requests for it wait for the result instead of computing it again.
+    """
+
+    poll_interval = 0.05
+
+    def __init__(
+        self, backend=RESPONSE_CACHE_BACKEND, ttl=RESPONSE_CACHE_TTL, lock_timeout=RESPONSE_CACHE_LOCK_TIMEOUT
+    ):
+        self.enabled = backend is not None
+        self.backend = backend
+        self.ttl = ttl
+        self.lock_timeout = lock_timeout
+        self._stats_lock = threading.Lock()
+        self.hits = self.misses = 0
+        self.recompute_seconds = 0.0
+
+    def make_key(self, path, params):
+        request_hash = hashlib.md5("{}?{}".format(path, params).encode("utf-8")).hexdigest()
+        return "fdadb:response:{}:{}".format(get_data_version(), request_hash)
+
+    def _hit(self, value):
+        with self._stats_lock:
+            self.hits += 1
+        return value
+
+    def get_or_set(self, path, params, compute):
+        """Return the cached response of the request or compute and cache it"""
+        if not self.enabled:
+            return compute()
+
+        cache = caches[self.backend]
+        key = self.make_key(path, params)
+        value = cache.get(key)
+        if value is not None:
+            return self._hit(value)
+
+        lock_key = key + ":lock"
+        deadline = time.monotonic() + self.lock_timeout
+        locked = cache.add(lock_key, True, timeout=self.lock_timeout)
+        while not locked and time.monotonic() < deadline:
+            time.sleep(self.poll_interval)
+            value = cache.get(key)
+            if value is not None:
+                return self._hit(value)
+            # the lock expired or was released without a result, e.g. after an error
+            locked = cache.add(lock_key, True, timeout=self.lock_timeout)
+
+        try:
+            start = time.monotonic()
+            value = compute()
+            cache.set(key, value, timeout=self.ttl)
+            with self._stats_lock:
+                self.misses += 1
+                self.recompute_seconds += time.monotonic() - start
+            return value
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    def stats(self):
+        requests = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": self.hits / requests if requests else 0.0,
+            "average_recompute_seconds": self.recompute_seconds / self.misses if self.misses else 0.0,
+        }
+
+
+autocomplete_cache = AutocompleteCache()
+response_cache = ResponseCache()
+
+
+def invalidate_autocomplete_cache():
+    """Invalidate cached autocomplete results with a new data version, called once medications are imported or
+    indexed"""
+    bump_data_version()
+    autocomplete_cache.clear()
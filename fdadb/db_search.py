@@ -0,0 +1,56 @@
+# -*- coding: utf-8 -*-
+from django.conf import settings
+from django.db import connections
+from django.db.models import BooleanField, Case, Q, Value, When
+
+# rank database search results with pg_trgm similarity on PostgreSQL
+TRIGRAM_SEARCH = getattr(settings, "FDADB_TRIGRAM_SEARCH", True)
+
+
+def is_trigram_search_enabled(queryset):
+    return TRIGRAM_SEARCH and connections[queryset.db].vendor == "postgresql"
+
+
+def search_queryset(queryset, field, q):
+    """Filter the queryset by the text in the field, the most similar results first on PostgreSQL.
+
+    On PostgreSQL the `icontains` filter uses the trigram GIN indexes created by the migrations.
+    """
+    queryset = queryset.filter(**{"{}__icontains".format(field): q})
+    if is_trigram_search_enabled(queryset):
+        # imported here, django.contrib.postgres requires psycopg2 on Django<4.2
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        queryset = queryset.annotate(similarity=TrigramSimilarity(field, q)).order_by("-similarity", "pk")
+    return queryset
+
+
+def get_search_filter(field, q):
+    # a condition matching all rows when there is no query, an empty Q() cannot be annotated
+    return Q(**{"{}__icontains".format(field): q}) if q else Q(pk__isnull=False)
+
+
+def search_many(queryset, searches, ordering=("pk",)):
+    """Return the rows of the queryset matching each search with a single query, in the order of the searches.
+
+    `searches` are (condition, size) pairs. The query selects the first rows of each search and flags the searches
+    they match, the flags distribute the rows between the searches.
+    """
+    if not searches:
+        return []
+
+    selected = Q()
+    flags = {}
+    for i, (condition, size) in enumerate(searches):
+        selected |= Q(pk__in=queryset.filter(condition).order_by(*ordering).values("pk")[:size])
+        flags["search_{}".format(i)] = Case(
+            When(condition, then=Value(True)), default=Value(False), output_field=BooleanField()
+        )
+
+    results = [[] for search in searches]
+    for row in queryset.filter(selected).annotate(**flags).order_by(*ordering):
+        for i, (condition, size) in enumerate(searches):
+            flag = "search_{}".format(i)
+            if (row[flag] if isinstance(row, dict) else getattr(row, flag)) and len(results[i]) < size:
+                results[i].append(row)
+    return results
@@ -1,10 +1,127 @@
 # -*- coding: utf-8 -*-
+import asyncio
 import json
+import os
+import threading
+import time
+import weakref
+from collections import OrderedDict
 
 from django.conf import settings
-from elasticsearch import Elasticsearch
+from django.utils import timezone
+from elasticsearch import Elasticsearch, helpers
 
-from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+from fdadb.cache import autocomplete_cache
+from fdadb.models import MedicationName, MedicationNDC, MedicationStrength, get_strength_search_string
+
+try:
+    from elasticsearch import AsyncElasticsearch
+except ImportError:  # pragma: no cover
+    # elasticsearch<7.8
+    AsyncElasticsearch = None
+
+# keyword arguments of the Elasticsearch client, e.g. connection pool size, timeouts and retries; their names depend on
+# the version of elasticsearch-py, so there are no defaults
+ES_CLIENT_OPTIONS = getattr(settings, "FDADB_ES_CLIENT_OPTIONS", {})
+ES_BULK_CHUNK_SIZE = getattr(settings, "FDADB_ES_BULK_CHUNK_SIZE", 500)
+ES_BULK_THREAD_COUNT = getattr(settings, "FDADB_ES_BULK_THREAD_COUNT", 1)
+ES_QUERYSET_CHUNK_SIZE = getattr(settings, "FDADB_ES_QUERYSET_CHUNK_SIZE", 2000)
+ES_NUMBER_OF_REPLICAS = getattr(settings, "FDADB_ES_NUMBER_OF_REPLICAS", 1)
+
+INDEX_SETTINGS = {
+    "analysis": {
+        "filter": {"autocomplete_filter": {"type": "edge_ngram", "min_gram": 1, "max_gram": 20}},
+        "analyzer": {
+            "autocomplete": {
+                "type": "custom",
+                "tokenizer": "standard",
+                "filter": ["lowercase", "autocomplete_filter"],
+            }
+        },
+    }
+}
+# searches use aliases named after the indexes, which point to the current generation of the index
+INDEX_MAPPINGS = OrderedDict(
+    [
+        (
+            "fda_medications_names",
+            {"medication_name": {"properties": {"name": {"type": "text", "analyzer": "autocomplete"}}}},
+        ),
+        (
+            "fda_medications_strengths",
+            {
+                "medication_strength": {
+                    "properties": {
+                        "id": {"type": "long"},
+                        "name": {"type": "keyword"},
+                        "strength_search_string": {"type": "text", "analyzer": "autocomplete"},
+                    }
+                }
+            },
+        ),
+        (
+            "fda_medications_ndcs",
+            {
+                "medication_ndc": {
+                    "properties": {
+                        "id": {"type": "long"},
+                        "name": {"type": "keyword"},
+                        "strength_id": {"type": "long"},
+                        "manufacturer": {"type": "text", "analyzer": "autocomplete"},
+                    }
+                }
+            },
+        ),
+    ]
+)
+
+
+_es_client = None
+_es_client_key = None
+_es_client_lock = threading.Lock()
+# async clients are bound to the event loop they were created in
+_async_es_clients = weakref.WeakKeyDictionary()
+
+
+def is_es_enabled():
+    return bool(getattr(settings, "ELASTICSEARCH_URL", None) and not getattr(settings, "TESTING", False))
+
+
+def get_es_client():
+    """Return the Elasticsearch client (with its connection pool) shared by the process"""
+    global _es_client, _es_client_key
+    # the client is created again in forked processes, they cannot share connections with the parent
+    key = (os.getpid(), settings.ELASTICSEARCH_URL)
+    if _es_client_key != key:
+        with _es_client_lock:
+            if _es_client_key != key:
+                _es_client = Elasticsearch([settings.ELASTICSEARCH_URL], **ES_CLIENT_OPTIONS)
+                _es_client_key = key
+    return _es_client
+
+
+def get_async_es_client():
+    """Return the AsyncElasticsearch client shared by the running event loop"""
+    if AsyncElasticsearch is None:
+        raise Exception("AsyncElasticsearch requires elasticsearch>=7.8 installed with the async extra")
+    loop = asyncio.get_running_loop()
+    url, client = _async_es_clients.get(loop, (None, None))
+    if url != settings.ELASTICSEARCH_URL:
+        client = AsyncElasticsearch([settings.ELASTICSEARCH_URL], **ES_CLIENT_OPTIONS)
+        _async_es_clients[loop] = (settings.ELASTICSEARCH_URL, client)
+    return client
+
+
+def reset_es_client():
+    global _es_client, _es_client_key, _es_client_lock
+    _es_client = _es_client_key = None
+    # the lock might have been held by another thread while forking
+    _es_client_lock = threading.Lock()
+    _async_es_clients.clear()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=reset_es_client)
 
 
 class EsSearchAPI(object):
@@ -12,154 +129,360 @@ class EsSearchAPI(object):
         es_url = getattr(settings, "ELASTICSEARCH_URL", None)
         if es_url is None:
             raise Exception("ELASTICSEARCH_URL not configured in settings")
-        self.es = Elasticsearch([settings.ELASTICSEARCH_URL])
+        self.es = get_es_client()
+
+    @classmethod
+    def _get_index_name(cls, alias, suffix):
+        return "{}_{}".format(alias, suffix)
+
+    def _create_index(self, alias, index, bulk_load=False):
+        index_settings = dict(INDEX_SETTINGS, number_of_replicas=ES_NUMBER_OF_REPLICAS)
+        if bulk_load:
+            # refreshing and replication are enabled once all documents are indexed
+            index_settings.update(refresh_interval="-1", number_of_replicas=0)
+        self.es.indices.create(index=index, body={"settings": index_settings, "mappings": INDEX_MAPPINGS[alias]})
+
+    def _get_aliased_indexes(self, alias):
+        if not self.es.indices.exists_alias(name=alias):
+            return []
+        return list(self.es.indices.get_alias(name=alias))
+
+    def _is_legacy_index(self, alias):
+        # indexes created before versioned indexes were introduced use the alias name
+        return bool(self.es.indices.exists(index=alias) and not self.es.indices.exists_alias(name=alias))
 
     def create_indexes(self):
-        self.es.indices.create(
-            index="fda_medications_names",
-            ignore=[400],  # ignore 400, so it ignores already existing
-            body={
-                "settings": {
-                    "analysis": {
-                        "filter": {"autocomplete_filter": {"type": "edge_ngram", "min_gram": 1, "max_gram": 20}},
-                        "analyzer": {
-                            "autocomplete": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "autocomplete_filter"],
-                            }
-                        },
-                    }
-                },
-                "mappings": {"medication_name": {"properties": {"name": {"type": "text", "analyzer": "autocomplete"}}}},
-            },
-        )
-        self.es.indices.create(
-            index="fda_medications_strengths",
-            ignore=[400],  # ignore 400, so it ignores already existing
-            body={
-                "settings": {
-                    "analysis": {
-                        "filter": {"autocomplete_filter": {"type": "edge_ngram", "min_gram": 1, "max_gram": 20}},
-                        "analyzer": {
-                            "autocomplete": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "autocomplete_filter"],
-                            }
-                        },
-                    }
-                },
-                "mappings": {
-                    "medication_strength": {
-                        "properties": {
-                            "name": {"type": "keyword"},
-                            "strength_search_string": {"type": "text", "analyzer": "autocomplete"},
-                        }
-                    }
-                },
-            },
-        )
-        self.es.indices.create(
-            index="fda_medications_ndcs",
-            ignore=[400],  # ignore 400, so it ignores already existing
-            body={
-                "settings": {
-                    "analysis": {
-                        "filter": {"autocomplete_filter": {"type": "edge_ngram", "min_gram": 1, "max_gram": 20}},
-                        "analyzer": {
-                            "autocomplete": {
-                                "type": "custom",
-                                "tokenizer": "standard",
-                                "filter": ["lowercase", "autocomplete_filter"],
-                            }
-                        },
-                    }
-                },
-                "mappings": {
-                    "medication_ndc": {
-                        "properties": {
-                            "name": {"type": "keyword"},
-                            "strength_id": {"type": "long"},
-                            "manufacturer": {"type": "text", "analyzer": "autocomplete"},
-                        }
-                    }
-                },
-            },
-        )
+        """Create the first generation of indexes with their aliases, if they do not exist yet"""
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        for alias in INDEX_MAPPINGS:
+            if not self.es.indices.exists(index=alias):
+                index = self._get_index_name(alias, suffix)
+                self._create_index(alias, index)
+                self.es.indices.put_alias(index=index, name=alias)
 
     def drop_indexes(self):
-        self.es.indices.delete(index="fda_medications_names", ignore=[400, 404])
-        self.es.indices.delete(index="fda_medications_strengths", ignore=[400, 404])
-        self.es.indices.delete(index="fda_medications_ndcs", ignore=[400, 404])
+        for alias in INDEX_MAPPINGS:
+            self.es.indices.delete(index=self._get_index_name(alias, "*"), ignore=[400, 404])
+            self.es.indices.delete(index=alias, ignore=[400, 404])
+
+    def _swap_aliases(self, indexes):
+        """Atomically move aliases to the new indexes and delete all other generations"""
+        actions = []
+        for alias, index in indexes.items():
+            for old_index in self._get_aliased_indexes(alias):
+                actions.append({"remove": {"index": old_index, "alias": alias}})
+            if self._is_legacy_index(alias):
+                actions.append({"remove_index": {"index": alias}})
+            actions.append({"add": {"index": index, "alias": alias}})
+        self.es.indices.update_aliases(body={"actions": actions})
+
+        for alias, index in indexes.items():
+            for old_index in self.es.indices.get(index=self._get_index_name(alias, "*"), ignore=[404]):
+                if old_index != index:
+                    self.es.indices.delete(index=old_index, ignore=[404])
 
     @classmethod
     def _get_strength_search_string(cls, strength):
-        return ", ".join("{} {} {}".format(key, value["strength"], value["unit"]) for key, value in strength.items())
+        return get_strength_search_string(strength)
+
+    @classmethod
+    def _get_name_doc(cls, row):
+        return {"name": row["name"], "active_substances": row["active_substances"]}
+
+    @classmethod
+    def _get_strength_doc(cls, row):
+        return {
+            "id": row["id"],
+            "name": row["medication_name_id"],
+            "active_substances": json.dumps(row["medication_name__active_substances"]),
+            "strength": json.dumps(row["strength"]),
+            "strength_search_string": row["strength_search"],
+        }
+
+    @classmethod
+    def _get_ndc_doc(cls, row):
+        return {
+            "id": row["id"],
+            "name": row["medication_strength__medication_name_id"],
+            "active_substances": json.dumps(row["medication_strength__medication_name__active_substances"]),
+            "strength": json.dumps(row["medication_strength__strength"]),
+            "strength_id": row["medication_strength_id"],
+            "ndc": row["ndc"],
+            "manufacturer": row["manufacturer"],
+        }
+
+    @classmethod
+    def _iterate_rows(cls, queryset, *fields):
+        # values() rows streamed in chunks (with server-side cursors where supported) keep memory usage flat
+        return queryset.order_by().values(*fields).iterator(chunk_size=ES_QUERYSET_CHUNK_SIZE)
+
+    def _bulk(self, actions, chunk_size=None, thread_count=None):
+        """Send actions with the bulk API, return numbers of successful and failed actions"""
+        chunk_size = chunk_size or ES_BULK_CHUNK_SIZE
+        thread_count = thread_count or ES_BULK_THREAD_COUNT
+        if thread_count > 1:
+            results = helpers.parallel_bulk(
+                self.es, actions, thread_count=thread_count, chunk_size=chunk_size, raise_on_error=False
+            )
+        else:
+            results = helpers.streaming_bulk(self.es, actions, chunk_size=chunk_size, raise_on_error=False)
 
-    def index_medications(self, drop_indexes=False):
+        succeeded = failed = 0
+        for ok, item in results:
+            if ok:
+                succeeded += 1
+            else:
+                failed += 1
+        return succeeded, failed
+
+    def _get_index_actions(self, names_queryset, strengths_queryset, ndcs_queryset, indexes):
+        """Return generators of bulk index actions for each index"""
+        return [
+            (
+                "fda_medications_names",
+                (
+                    {
+                        "_index": indexes["fda_medications_names"],
+                        "_type": "medication_name",
+                        "_id": row["name"],
+                        "_source": self._get_name_doc(row),
+                    }
+                    for row in self._iterate_rows(names_queryset, "name", "active_substances")
+                ),
+            ),
+            (
+                "fda_medications_strengths",
+                (
+                    {
+                        "_index": indexes["fda_medications_strengths"],
+                        "_type": "medication_strength",
+                        "_id": row["id"],
+                        "_source": self._get_strength_doc(row),
+                    }
+                    for row in self._iterate_rows(
+                        strengths_queryset,
+                        "id",
+                        "strength",
+                        "strength_search",
+                        "medication_name_id",
+                        "medication_name__active_substances",
+                    )
+                ),
+            ),
+            (
+                "fda_medications_ndcs",
+                (
+                    {
+                        "_index": indexes["fda_medications_ndcs"],
+                        "_type": "medication_ndc",
+                        "_id": row["id"],
+                        "_source": self._get_ndc_doc(row),
+                    }
+                    for row in self._iterate_rows(
+                        ndcs_queryset,
+                        "id",
+                        "ndc",
+                        "manufacturer",
+                        "medication_strength_id",
+                        "medication_strength__strength",
+                        "medication_strength__medication_name_id",
+                        "medication_strength__medication_name__active_substances",
+                    )
+                ),
+            ),
+        ]
+
+    def _index_querysets(
+        self, names_queryset, strengths_queryset, ndcs_queryset, indexes=None, chunk_size=None, thread_count=None
+    ):
+        """Index objects from the querysets (by default through aliases), return indexing stats for each index"""
+        indexes = indexes or OrderedDict((alias, alias) for alias in INDEX_MAPPINGS)
+        stats = OrderedDict()
+        for index, actions in self._get_index_actions(names_queryset, strengths_queryset, ndcs_queryset, indexes):
+            start = time.monotonic()
+            indexed, failed = self._bulk(actions, chunk_size=chunk_size, thread_count=thread_count)
+            stats[index] = {"indexed": indexed, "failed": failed, "seconds": time.monotonic() - start}
+        return stats
+
+    def index_medications(self, drop_indexes=False, chunk_size=None, thread_count=None):
+        """Index all medications into a new generation of indexes and move the aliases used for searching to it"""
         if drop_indexes:
             self.drop_indexes()
-        self.create_indexes()
 
-        for medication_name in MedicationName.objects.all():
-            doc = {"name": medication_name.name, "active_substances": medication_name.active_substances}
-            self.es.index(index="fda_medications_names", doc_type="medication_name", id=medication_name.name, body=doc)
+        suffix = timezone.now().strftime("%Y%m%d%H%M%S%f")
+        indexes = OrderedDict((alias, self._get_index_name(alias, suffix)) for alias in INDEX_MAPPINGS)
+        for alias, index in indexes.items():
+            self._create_index(alias, index, bulk_load=True)
 
-        for medication_strength in MedicationStrength.objects.select_related("medication_name").all():
-            doc = {
-                "name": medication_strength.medication_name.name,
-                "active_substances": json.dumps(medication_strength.medication_name.active_substances),
-                "strength": json.dumps(medication_strength.strength),
-                "strength_search_string": self._get_strength_search_string(medication_strength.strength),
-            }
-            self.es.index(
-                index="fda_medications_strengths", doc_type="medication_strength", id=medication_strength.id, body=doc
+        try:
+            stats = self._index_querysets(
+                MedicationName.objects.all(),
+                MedicationStrength.objects.all(),
+                MedicationNDC.objects.all(),
+                indexes=indexes,
+                chunk_size=chunk_size,
+                thread_count=thread_count,
             )
+            for index in indexes.values():
+                self.es.indices.put_settings(
+                    index=index,
+                    body={"index": {"refresh_interval": "1s", "number_of_replicas": ES_NUMBER_OF_REPLICAS}},
+                )
+                self.es.indices.refresh(index=index)
+        except Exception:
+            self.es.indices.delete(index=",".join(indexes.values()), ignore=[404])
+            raise
 
-        for medication_ndc in MedicationNDC.objects.select_related(
-            "medication_strength", "medication_strength__medication_name"
-        ).all():
-            doc = {
-                "name": medication_ndc.medication_strength.medication_name.name,
-                "active_substances": json.dumps(medication_ndc.medication_strength.medication_name.active_substances),
-                "strength": json.dumps(medication_ndc.medication_strength.strength),
-                "strength_id": medication_ndc.medication_strength_id,
-                "ndc": medication_ndc.ndc,
-                "manufacturer": medication_ndc.manufacturer,
-            }
-            self.es.index(index="fda_medications_ndcs", doc_type="medication_ndc", id=medication_ndc.id, body=doc)
+        self._swap_aliases(indexes)
+        return stats
+
+    def index_changed_medications(self, names=(), strength_ids=(), ndcs=()):
+        """Index given medication names, strength ids and NDC codes (used by incremental imports)"""
+        self.create_indexes()
+
+        return self._index_querysets(
+            MedicationName.objects.filter(name__in=names),
+            MedicationStrength.objects.filter(id__in=strength_ids),
+            MedicationNDC.objects.filter(ndc__in=ndcs),
+        )
+
+    def delete_medications(self, names=(), strength_ids=(), ndc_ids=()):
+        """Remove documents of deleted medication names, strengths and NDCs from the indexes"""
+        actions = (
+            {"_op_type": "delete", "_index": index, "_type": doc_type, "_id": doc_id}
+            for index, doc_type, ids in (
+                ("fda_medications_names", "medication_name", names),
+                ("fda_medications_strengths", "medication_strength", strength_ids),
+                ("fda_medications_ndcs", "medication_ndc", ndc_ids),
+            )
+            for doc_id in ids
+        )
+        # documents missing in the indexes are reported as failed, there is nothing else to do with them
+        self._bulk(actions)
 
     @classmethod
     def _format_response(cls, response):
-        count, results = response["hits"]["total"], [x["_source"] for x in response["hits"]["hits"]]
+        total = response["hits"]["total"]
+        # ElasticSearch 7+ returns {"value": ..., "relation": ...}
+        count = total["value"] if isinstance(total, dict) else total
+        results = [x["_source"] for x in response["hits"]["hits"]]
         for item in results:
             for key in ("strength", "active_substances"):
                 if key in item and isinstance(item[key], str):
                     item[key] = json.loads(item[key])
         return count, results
 
-    def search_name(self, name_search_string, size=10):
-        if not name_search_string:
-            body = {"query": {"match_all": {}}, "size": size}
-        else:
-            body = {"query": {"match": {"name": name_search_string}}, "size": size}
-        response = self.es.search(index="fda_medications_names", body=body)
-        return self._format_response(response)
+    @classmethod
+    def get_name_search_body(cls, name_search_string, size, offset):
+        query = {"match": {"name": name_search_string}} if name_search_string else {"match_all": {}}
+        # ElasticSearch 7+ counts hits up to 10000 unless total hits are tracked
+        return {"query": query, "from": offset, "size": size, "track_total_hits": True}
 
-    def search_strength(self, name, strength_search_string):
-        body = {"size": 10, "query": {"bool": {"filter": {"term": {"name": name}}}}}
+    @classmethod
+    def get_strength_search_body(cls, name, strength_search_string, size, offset):
+        body = {
+            "from": offset,
+            "size": size,
+            "track_total_hits": True,
+            "query": {"bool": {"filter": {"term": {"name": name}}}},
+            "sort": [{"_score": {"order": "desc"}}, {"id": {"order": "asc"}}],
+        }
         if strength_search_string:
             body["query"]["bool"]["must"] = {"match": {"strength_search_string": strength_search_string}}
-        response = self.es.search(index="fda_medications_strengths", body=body)
-        return self._format_response(response)
+        return body
 
-    def search_ndc(self, name, strength_id, manufacturer_search_string):
+    @classmethod
+    def get_ndc_search_body(cls, name, strength_id, manufacturer_search_string, size, offset):
         body = {
-            "size": 10,
+            "from": offset,
+            "size": size,
+            "track_total_hits": True,
             "query": {"bool": {"filter": [{"term": {"name": name}}, {"term": {"strength_id": strength_id}}]}},
+            "sort": [{"_score": {"order": "desc"}}, {"id": {"order": "asc"}}],
         }
         if manufacturer_search_string:
             body["query"]["bool"]["must"] = {"match": {"manufacturer": manufacturer_search_string}}
+        return body
+
+    def search_name(self, name_search_string, size=10, offset=0):
+        return autocomplete_cache.get_or_set(
+            "es", name_search_string, size, lambda: self._search_name(name_search_string, size, offset), offset=offset
+        )
+
+    def _search_name(self, name_search_string, size, offset):
+        body = self.get_name_search_body(name_search_string, size, offset)
+        response = self.es.search(index="fda_medications_names", body=body)
+        return self._format_response(response)
+
+    def search_strength(self, name, strength_search_string, size=10, offset=0):
+        body = self.get_strength_search_body(name, strength_search_string, size, offset)
+        response = self.es.search(index="fda_medications_strengths", body=body)
+        return self._format_response(response)
+
+    def search_ndc(self, name, strength_id, manufacturer_search_string, size=10, offset=0):
+        body = self.get_ndc_search_body(name, strength_id, manufacturer_search_string, size, offset)
         response = self.es.search(index="fda_medications_ndcs", body=body)
         return self._format_response(response)
+
+    @classmethod
+    def get_search(cls, query):
+        """Return the index and the body of a search of search_many"""
+        q, size = query.get("q"), query.get("size", 10)
+        if query["type"] == "name":
+            return "fda_medications_names", cls.get_name_search_body(q, size, 0)
+        elif query["type"] == "strength":
+            return "fda_medications_strengths", cls.get_strength_search_body(query["name"], q, size, 0)
+        elif query["type"] == "ndc":
+            return "fda_medications_ndcs", cls.get_ndc_search_body(query["name"], query["strength_id"], q, size, 0)
+        raise ValueError("Unknown search type: {}".format(query["type"]))
+
+    def search_many(self, queries):
+        """Run several searches in a single msearch request and return their results in the order of the queries.
+
+        Queries are dicts with the "type" of the search ("name", "strength" or "ndc"), the "q" query and the "size" of
+        the results, strength and NDC searches also have the medication "name" and NDC searches the "strength_id".
+        """
+        if not queries:
+            return []
+
+        body = []
+        for query in queries:
+            index, search_body = self.get_search(query)
+            body.extend(({"index": index}, search_body))
+        response = self.es.msearch(body=body)
+
+        results = []
+        for item in response["responses"]:
+            if "error" in item:
+                raise Exception("ElasticSearch search failed: {}".format(item["error"]))
+            results.append(self._format_response(item)[1])
+        return results
+
+
+class AsyncEsSearchAPI(object):
+    """Searches of EsSearchAPI sent with the AsyncElasticsearch client, for async views"""
+
+    def __init__(self):
+        if getattr(settings, "ELASTICSEARCH_URL", None) is None:
+            raise Exception("ELASTICSEARCH_URL not configured in settings")
+        self.es = get_async_es_client()
+
+    async def search_name(self, name_search_string, size=10, offset=0):
+        return await autocomplete_cache.aget_or_set(
+            "es", name_search_string, size, lambda: self._search_name(name_search_string, size, offset), offset=offset
+        )
+
+    async def _search_name(self, name_search_string, size, offset):
+        body = EsSearchAPI.get_name_search_body(name_search_string, size, offset)
+        response = await self.es.search(index="fda_medications_names", body=body)
+        return EsSearchAPI._format_response(response)
+
+    async def search_strength(self, name, strength_search_string, size=10, offset=0):
+        body = EsSearchAPI.get_strength_search_body(name, strength_search_string, size, offset)
+        response = await self.es.search(index="fda_medications_strengths", body=body)
+        return EsSearchAPI._format_response(response)
+
+    async def search_ndc(self, name, strength_id, manufacturer_search_string, size=10, offset=0):
+        body = EsSearchAPI.get_ndc_search_body(name, strength_id, manufacturer_search_string, size, offset)
+        response = await self.es.search(index="fda_medications_ndcs", body=body)
+        return EsSearchAPI._format_response(response)
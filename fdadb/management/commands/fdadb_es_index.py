@@ -1,6 +1,7 @@
 # -*- coding: utf-8 -*-
 from django.core.management.base import BaseCommand
 
+from fdadb.cache import invalidate_autocomplete_cache
 from fdadb.es_search import EsSearchAPI
 
 
@@ -15,8 +16,34 @@ class Command(BaseCommand):
             default=False,
             help="Should indexes be removed before reindexing?",
         )
+        parser.add_argument(
+            "--chunk_size",
+            type=int,
+            dest="chunk_size",
+            default=None,
+            help="Number of documents sent in a single bulk request",
+        )
+        parser.add_argument(
+            "--thread_count",
+            type=int,
+            dest="thread_count",
+            default=None,
+            help="Number of threads sending bulk requests",
+        )
 
     def handle(self, *args, **kwargs):
         drop_indexes = kwargs.get("drop_indexes")
 
-        EsSearchAPI().index_medications(drop_indexes=drop_indexes)
+        stats = EsSearchAPI().index_medications(
+            drop_indexes=drop_indexes, chunk_size=kwargs.get("chunk_size"), thread_count=kwargs.get("thread_count")
+        )
+        invalidate_autocomplete_cache()
+        for index, index_stats in stats.items():
+            self.stdout.write(
+                "{}: {} documents indexed, {} failed, {:.0f} documents/s".format(
+                    index,
+                    index_stats["indexed"],
+                    index_stats["failed"],
+                    index_stats["indexed"] / index_stats["seconds"] if index_stats["seconds"] else 0,
+                )
+            )
@@ -1,63 +1,640 @@
 import csv
+import hashlib
+import io
+import json
+import multiprocessing
+import os
+import queue
+import sys
+import tempfile
+import threading
+import time
 import zipfile
-from collections import OrderedDict
-from io import BytesIO, TextIOWrapper
+from binascii import unhexlify
+from collections import Counter, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from io import TextIOWrapper
+from itertools import islice
 
 import requests
 from django.conf import settings
-from django.core.management.base import BaseCommand
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection, transaction
+from django.db.migrations.state import ModelState, ProjectState
+from django.db.models import Max
+from django.utils import timezone
 
-from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+from fdadb.cache import invalidate_autocomplete_cache
+from fdadb.es_search import EsSearchAPI, is_es_enabled
+from fdadb.models import (ImportCheckpoint, MedicationName, MedicationNDC, MedicationStrength,
+                          MedicationStrengthIngredient, get_strength_search_string)
+from fdadb.ndc_parser import get_medication_strength_data, parse_products
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    # not available on Windows
+    resource = None
 
 FDA_NDC_DATABASE_URL = getattr(
     settings, "FDA_NDC_DATABASE_URL", "https://www.accessdata.fda.gov/cder/ndctext.zip"
 )
+# keep the default below SQLite's limit of host parameters in a single query
+FDADB_IMPORT_BATCH_SIZE = getattr(settings, "FDADB_IMPORT_BATCH_SIZE", 500)
+# number of worker processes parsing products, 0 parses them in the main process
+FDADB_IMPORT_WORKERS = getattr(settings, "FDADB_IMPORT_WORKERS", 0)
+FDADB_CACHE_DIR = getattr(settings, "FDADB_CACHE_DIR", os.path.join(tempfile.gettempdir(), "fdadb"))
+CACHE_ARCHIVE_FILE_NAME = "ndctext.zip"
+CACHE_METADATA_FILE_NAME = "ndctext.json"
+DOWNLOAD_CHUNK_SIZE = 1024 * 1024
+STAGING_TABLE_SUFFIX = "_staging"
+# models saved by the import, the ones referenced by foreign keys first
+IMPORT_MODELS = (MedicationName, MedicationStrength, MedicationStrengthIngredient, MedicationNDC)
+# trigram indexes created by the migrations on PostgreSQL, icontains lookups compare UPPER("column"::text)
+TRIGRAM_INDEXES = ((MedicationName, "name"), (MedicationStrength, "strength_search"), (MedicationNDC, "manufacturer"))
+
+
+def chunks(iterable, size):
+    """Split iterable into lists of at most `size` items"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def get_file_sha256(f):
+    """Return the SHA-256 of the content of the file and rewind it"""
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: f.read(DOWNLOAD_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+
+def get_staging_models():
+    """Return copies of the imported models saved to staging tables, with foreign keys between them"""
+    state = ProjectState()
+    for model in IMPORT_MODELS:
+        model_state = ModelState.from_model(model)
+        model_state.options["db_table"] = model._meta.db_table + STAGING_TABLE_SUFFIX
+        state.add_model(model_state)
+    return [state.apps.get_model(model._meta.app_label, model._meta.model_name) for model in IMPORT_MODELS]
+
+
+def get_trigram_index_name(table, column):
+    return "{}_{}_trgm".format(table, column)
+
+
+def copy_rows(model, objs):
+    """Insert model instances with COPY on PostgreSQL, primary keys are copied when all instances have them"""
+    with_pk = all(obj.pk is not None for obj in objs)
+    fields = [
+        field
+        for field in model._meta.local_concrete_fields
+        if not field.auto_created or (field.primary_key and with_pk)
+    ]
+    data = io.StringIO()
+    writer = csv.writer(data)
+    for obj in objs:
+        values = (field.get_db_prep_save(getattr(obj, field.attname), connection) for field in fields)
+        writer.writerow("\\N" if value is None else value for value in values)
+    data.seek(0)
+
+    sql = "COPY {} ({}) FROM STDIN WITH (FORMAT csv, NULL '\\N')".format(
+        connection.ops.quote_name(model._meta.db_table),
+        ", ".join(connection.ops.quote_name(field.column) for field in fields),
+    )
+    with connection.cursor() as cursor:
+        if hasattr(cursor.cursor, "copy"):
+            # psycopg 3
+            with cursor.cursor.copy(sql) as copy:
+                copy.write(data.getvalue())
+        else:
+            cursor.cursor.copy_expert(sql, data)
 
 
-def strip_list_items(items):
-    """Apply str.strip to all items in a list"""
-    return list(map(str.strip, items))
+def get_peak_memory():
+    """Return the peak resident memory of the process in bytes, None when it is not available"""
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return max_rss if sys.platform == "darwin" else max_rss * 1024
 
 
 class Command(BaseCommand):
     help = "Fetch the National Drug Codes and save the result to the database"
+    # models the products are saved to, replaced by staging models with --staging
+    name_model, strength_model, ingredient_model, ndc_model = IMPORT_MODELS
+    staging = False
 
-    def fetch_database_file(self):
-        # fetch the zip file from FDA site
-        response = requests.get(FDA_NDC_DATABASE_URL)
-        response.raise_for_status()
-        return response.content
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            dest="batch_size",
+            default=FDADB_IMPORT_BATCH_SIZE,
+            help="Number of products parsed and saved in a single batch",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            dest="workers",
+            default=FDADB_IMPORT_WORKERS,
+            help="Number of worker processes parsing products while batches are read and saved, "
+            "0 parses them in the main process",
+        )
+        parser.add_argument(
+            "--file",
+            dest="file",
+            default=None,
+            help="Path to an already downloaded NDC database zip file",
+        )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            dest="force",
+            default=False,
+            help="Import the NDC database even if it did not change since the last import",
+        )
+        parser.add_argument(
+            "--sync",
+            action="store_true",
+            dest="sync",
+            default=False,
+            help="Save only changed products, remove products missing from the database file "
+            "and update ElasticSearch indexes",
+        )
+        parser.add_argument(
+            "--staging",
+            action="store_true",
+            dest="staging",
+            default=False,
+            help="Load the products into staging tables and replace the medications tables with them once complete",
+        )
+        parser.add_argument(
+            "--no-resume",
+            action="store_false",
+            dest="resume",
+            default=True,
+            help="Import the whole NDC database even if an interrupted import of the same archive can be resumed",
+        )
 
-    def get_products_data(self):
-        # extract and read product.txt from the archive
-        buffer = BytesIO()
-        buffer.write(self.fetch_database_file())
-        z = zipfile.ZipFile(buffer)
+    def load_cache_metadata(self):
+        try:
+            with open(os.path.join(FDADB_CACHE_DIR, CACHE_METADATA_FILE_NAME)) as f:
+                metadata = json.load(f)
+        except (OSError, ValueError):
+            return {}
+        return metadata if metadata.get("url") == FDA_NDC_DATABASE_URL else {}
+
+    def save_cache_metadata(self, metadata):
+        with open(os.path.join(FDADB_CACHE_DIR, CACHE_METADATA_FILE_NAME), "w") as f:
+            json.dump(metadata, f)
+
+    def fetch_database_file(self, force=False):
+        """Return the zip file from FDA site or None, when it did not change since the last import"""
+        metadata = {} if force else self.load_cache_metadata()
+        headers = {}
+        if metadata.get("etag"):
+            headers["If-None-Match"] = metadata["etag"]
+        if metadata.get("last_modified"):
+            headers["If-Modified-Since"] = metadata["last_modified"]
 
-        with z.open("product.txt") as f:
+        # stream the zip file to a temporary file in the cache directory
+        os.makedirs(FDADB_CACHE_DIR, exist_ok=True)
+        with requests.get(FDA_NDC_DATABASE_URL, headers=headers, stream=True) as response:
+            if response.status_code == 304:
+                return None
+            response.raise_for_status()
+
+            digest = hashlib.sha256()
+            with tempfile.NamedTemporaryFile(dir=FDADB_CACHE_DIR, suffix=".zip", delete=False) as database_file:
+                try:
+                    for chunk in response.iter_content(chunk_size=DOWNLOAD_CHUNK_SIZE):
+                        database_file.write(chunk)
+                        digest.update(chunk)
+                except BaseException:
+                    # do not leave partial downloads in the cache directory
+                    database_file.close()
+                    os.remove(database_file.name)
+                    raise
+
+        new_metadata = {
+            "url": FDA_NDC_DATABASE_URL,
+            "etag": response.headers.get("ETag"),
+            "last_modified": response.headers.get("Last-Modified"),
+            "sha256": digest.hexdigest(),
+        }
+        if metadata.get("sha256") == new_metadata["sha256"]:
+            os.remove(database_file.name)
+            self.save_cache_metadata(new_metadata)
+            return None
+
+        archive_path = os.path.join(FDADB_CACHE_DIR, CACHE_ARCHIVE_FILE_NAME)
+        os.replace(database_file.name, archive_path)
+        # saved once the import is finished, so a failed import is repeated on the next run
+        self.cache_metadata = new_metadata
+        return open(archive_path, "rb")
+
+    def open_database_file(self, file_path=None, force=False):
+        if file_path:
+            return open(file_path, "rb")
+        return self.fetch_database_file(force=force)
+
+    def get_products_data(self, database_file):
+        # extract and read product.txt from the archive
+        with database_file, zipfile.ZipFile(database_file) as z, z.open("product.txt") as f:
             f = TextIOWrapper(f, encoding="cp1252")
             yield from csv.DictReader(f, delimiter="\t")
 
     def get_medication_strength_data(self, product_data):
-        # some product does not provide substance name
-        substance_name = product_data["SUBSTANCENAME"]
-        if not substance_name:
-            return {}
+        return get_medication_strength_data(product_data)
+
+    def read_batches(self, database_file, batch_size, stage_stats, skip_rows=0):
+        """Reader stage: yield batches of rows of the database file, after the first `skip_rows` rows"""
+        start = time.monotonic()
+        for rows in chunks(islice(self.get_products_data(database_file), skip_rows, None), batch_size):
+            stage_stats["reader"] += time.monotonic() - start
+            yield rows
+            start = time.monotonic()
+
+    def get_parsed_batches(self, database_file, batch_size, workers, stage_stats, skip_rows=0):
+        """Yield parsed batches of products (see parse_products) in the order of the database file.
+
+        With workers, a reader thread submits batches of rows to a pool of worker processes and puts their futures in a
+        bounded queue, the saving of the batches (the writer stage) takes them from it. The queue stops the reader when
+        the writer falls behind.
+        """
+        if not workers:
+            for rows in self.read_batches(database_file, batch_size, stage_stats, skip_rows):
+                yield parse_products(rows)
+            return
+
+        parsed_batches = queue.Queue(maxsize=workers * 2)
+        stop = threading.Event()
 
-        active_substances = strip_list_items(substance_name.split(";"))
-        substances_strength = strip_list_items(
-            product_data["ACTIVE_NUMERATOR_STRENGTH"].split(";")
+        def read():
+            try:
+                for rows in self.read_batches(database_file, batch_size, stage_stats, skip_rows):
+                    parsed_batches.put(executor.submit(parse_products, rows))
+                    if stop.is_set():
+                        return
+            except Exception as e:
+                parsed_batches.put(e)
+            finally:
+                parsed_batches.put(None)
+
+        # workers do not need the state of the main process (e.g. database connections)
+        with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            reader = threading.Thread(target=read, daemon=True)
+            reader.start()
+            try:
+                while True:
+                    parsed_batch = parsed_batches.get()
+                    if parsed_batch is None:
+                        break
+                    if isinstance(parsed_batch, Exception):
+                        raise parsed_batch
+                    yield parsed_batch.result()
+            finally:
+                # unblock the reader when the import failed
+                stop.set()
+                while reader.is_alive():
+                    try:
+                        parsed_batches.get(timeout=0.1)
+                    except queue.Empty:
+                        pass
+
+    def insert_rows(self, model, objs, batch_size):
+        """Insert new rows, with COPY into staging tables on PostgreSQL"""
+        objs = list(objs)
+        if self.staging and connection.vendor == "postgresql":
+            copy_rows(model, objs)
+        else:
+            model.objects.bulk_create(objs, batch_size=batch_size)
+        self.inserted[model._meta.model_name] += len(objs)
+
+    def save_names(self, products, batch_size, update=False):
+        # the first product with a given name defines its active substances, a synchronisation only gets changed
+        # products and takes them from the first product of the name read from the file
+        names = OrderedDict()
+        for product in products:
+            names.setdefault(product.name, list(product.strength.keys()))
+        if update:
+            names.update((name, self.name_substances.get(name, substances)) for name, substances in names.items())
+
+        existing = dict(
+            self.name_model.objects.filter(name__in=names).values_list("name", "active_substances")
         )
-        substances_units = strip_list_items(
-            product_data["ACTIVE_INGRED_UNIT"].split(";")
+        self.insert_rows(
+            self.name_model,
+            [
+                self.name_model(name=name, active_substances=active_substances)
+                for name, active_substances in names.items()
+                if name not in existing
+            ],
+            batch_size,
         )
-        return OrderedDict(
-            (substance, {"strength": strength, "unit": unit})
-            for substance, strength, unit in zip(
-                active_substances, substances_strength, substances_units
+        if update:
+            self.name_model.objects.bulk_update(
+                [
+                    self.name_model(name=name, active_substances=active_substances)
+                    for name, active_substances in names.items()
+                    if name in existing and existing[name] != active_substances
+                ],
+                ["active_substances"],
+                batch_size=batch_size,
             )
+
+    def get_strength_ids(self, names, model=None):
+        model = model or self.strength_model
+        return {
+            (medication_name_id, strength_hash): pk
+            for pk, medication_name_id, strength_hash in model.objects.filter(
+                medication_name_id__in=names
+            ).values_list("pk", "medication_name_id", "strength_hash")
+        }
+
+    def set_staging_ids(self, objs, live_ids):
+        """Give staging rows the ids of the same rows (by the keys of `objs`) in the medications tables and new rows ids
+        after the largest one, so ids in URLs, cursors and ElasticSearch documents stay valid once the tables are
+        replaced"""
+        for key, obj in objs.items():
+            if key in live_ids:
+                obj.pk = live_ids[key]
+            else:
+                self.last_ids[obj._meta.model_name] += 1
+                obj.pk = self.last_ids[obj._meta.model_name]
+
+    def save_strengths(self, products, batch_size):
+        names = {product.name for product in products}
+        strength_ids = self.get_strength_ids(names)
+
+        new_strengths = OrderedDict()
+        for product in products:
+            key = (product.name, product.strength_hash)
+            if key not in strength_ids and key not in new_strengths:
+                new_strengths[key] = self.strength_model(
+                    medication_name_id=product.name,
+                    strength=product.strength,
+                    strength_search=get_strength_search_string(product.strength),
+                    strength_hash=product.strength_hash,
+                )
+
+        if new_strengths and self.staging:
+            self.set_staging_ids(new_strengths, self.get_strength_ids(names, MedicationStrength))
+        if new_strengths:
+            created = self.strength_model.objects.bulk_create(
+                new_strengths.values(), batch_size=batch_size
+            )
+            self.inserted[self.strength_model._meta.model_name] += len(created)
+            if all(obj.pk is not None for obj in created):
+                strength_ids.update(
+                    (key, obj.pk) for key, obj in zip(new_strengths, created)
+                )
+            else:
+                # the database backend does not return primary keys from bulk inserts
+                strength_ids = self.get_strength_ids(names)
+            self.insert_rows(
+                self.ingredient_model,
+                [
+                    self.ingredient_model(
+                        medication_strength_id=strength_ids[key],
+                        substance=substance,
+                        strength=value["strength"],
+                        unit=value["unit"],
+                    )
+                    for key, medication_strength in new_strengths.items()
+                    for substance, value in medication_strength.strength.items()
+                ],
+                batch_size=batch_size,
+            )
+        return strength_ids
+
+    def save_ndcs(self, products, strength_ids, batch_size, update=False):
+        existing = dict(
+            self.ndc_model.objects.filter(
+                ndc__in=[product.ndc for product in products]
+            ).values_list("ndc", "pk")
+        )
+        new_ndcs, updated_ndcs = OrderedDict(), OrderedDict()
+        for product in products:
+            if product.ndc in new_ndcs or product.ndc in updated_ndcs:
+                continue
+            if product.ndc in existing and not update:
+                continue
+            medication_ndc = self.ndc_model(
+                pk=existing.get(product.ndc),
+                ndc=product.ndc,
+                manufacturer=product.manufacturer,
+                fingerprint=product.fingerprint,
+                medication_strength_id=strength_ids[(product.name, product.strength_hash)],
+            )
+            if medication_ndc.pk is None:
+                new_ndcs[product.ndc] = medication_ndc
+            else:
+                updated_ndcs[product.ndc] = medication_ndc
+
+        if new_ndcs and self.staging:
+            self.set_staging_ids(
+                new_ndcs, dict(MedicationNDC.objects.filter(ndc__in=new_ndcs).values_list("ndc", "pk"))
+            )
+        self.insert_rows(self.ndc_model, new_ndcs.values(), batch_size)
+        if updated_ndcs:
+            self.ndc_model.objects.bulk_update(
+                updated_ndcs.values(),
+                ["medication_strength", "manufacturer", "fingerprint"],
+                batch_size=batch_size,
+            )
+
+    def save_products(self, products, batch_size, update=False):
+        """Save products and return ids of their strengths"""
+        with transaction.atomic():
+            self.save_names(products, batch_size, update=update)
+            strength_ids = self.save_strengths(products, batch_size)
+            self.save_ndcs(products, strength_ids, batch_size, update=update)
+        return {
+            strength_ids[(product.name, product.strength_hash)]
+            for product in products
+        }
+
+    def delete_products(self, ndcs, batch_size):
+        """Delete given NDCs with strengths and names left without NDCs, return ids of deleted objects"""
+        with transaction.atomic():
+            ndc_ids = []
+            for ndcs_chunk in chunks(ndcs, batch_size):
+                queryset = MedicationNDC.objects.filter(ndc__in=ndcs_chunk)
+                ndc_ids.extend(queryset.values_list("pk", flat=True))
+                queryset.delete()
+
+            strengths = MedicationStrength.objects.filter(ndcs__isnull=True)
+            strength_ids = list(strengths.values_list("pk", flat=True))
+            strengths.delete()
+
+            names = MedicationName.objects.filter(strengths__isnull=True)
+            deleted_names = list(names.values_list("pk", flat=True))
+            names.delete()
+        return deleted_names, strength_ids, ndc_ids
+
+    def get_checkpoint_rows(self, archive_hash):
+        """Return the number of rows saved by an interrupted import of the archive"""
+        checkpoint = ImportCheckpoint.objects.filter(pk=1, archive_hash=archive_hash).first()
+        return checkpoint.rows if checkpoint else 0
+
+    def save_checkpoint(self, archive_hash, rows):
+        ImportCheckpoint.objects.update_or_create(
+            pk=1, defaults={"archive_hash": archive_hash, "rows": rows, "updated": timezone.now()}
         )
 
+    def create_staging_tables(self):
+        """Create empty staging tables the products are saved to, return SQL creating their indexes"""
+        self.drop_staging_tables()
+        staging_models = get_staging_models()
+        with connection.schema_editor() as schema_editor:
+            for model in staging_models:
+                schema_editor.create_model(model)
+            # indexes and foreign key constraints are created once the tables are loaded
+            index_sql, schema_editor.deferred_sql = schema_editor.deferred_sql, []
+
+        if connection.vendor == "postgresql":
+            for model, column in TRIGRAM_INDEXES:
+                table = model._meta.db_table + STAGING_TABLE_SUFFIX
+                index_sql.append(
+                    "CREATE INDEX {} ON {} USING gin (UPPER({}::text) gin_trgm_ops)".format(
+                        connection.ops.quote_name(get_trigram_index_name(table, column)),
+                        connection.ops.quote_name(table),
+                        connection.ops.quote_name(column),
+                    )
+                )
+
+        self.staging = True
+        self.name_model, self.strength_model, self.ingredient_model, self.ndc_model = staging_models
+        # largest ids of the medications tables, see set_staging_ids
+        self.last_ids = {
+            model._meta.model_name: model.objects.aggregate(Max("pk"))["pk__max"] or 0
+            for model in (MedicationStrength, MedicationNDC)
+        }
+        return index_sql
+
+    def drop_staging_tables(self):
+        tables = set(connection.introspection.table_names())
+        with connection.schema_editor() as schema_editor:
+            for model in reversed(get_staging_models()):
+                if model._meta.db_table in tables:
+                    schema_editor.delete_model(model)
+
+    def replace_with_staging_tables(self, index_sql):
+        """Index and validate the staging tables, then replace the medications tables with them in a transaction"""
+        staging_models = (self.name_model, self.strength_model, self.ingredient_model, self.ndc_model)
+        with connection.schema_editor() as schema_editor:
+            for sql in index_sql:
+                schema_editor.execute(sql)
+            # rows were inserted with ids, new rows of the replaced tables get ids after them
+            for sql in connection.ops.sequence_reset_sql(no_style(), staging_models):
+                schema_editor.execute(sql)
+
+        counts = {model._meta.model_name: model.objects.count() for model in staging_models}
+        if not counts[self.ndc_model._meta.model_name] or any(
+            count != self.inserted[model_name] for model_name, count in counts.items()
+        ):
+            raise Exception(
+                "Staging tables do not contain the saved products: {} rows, {} saved".format(
+                    counts, dict(self.inserted)
+                )
+            )
+
+        with connection.schema_editor() as schema_editor:
+            index_names = [
+                self.get_live_index_names(schema_editor, staging_model, model)
+                for model, staging_model in zip(IMPORT_MODELS, staging_models)
+            ]
+            for model in reversed(IMPORT_MODELS):
+                schema_editor.delete_model(model)
+            for model, staging_model, names in zip(IMPORT_MODELS, staging_models, index_names):
+                schema_editor.alter_db_table(staging_model, staging_model._meta.db_table, model._meta.db_table)
+                self.rename_staging_indexes(schema_editor, staging_model, model, names)
+
+        self.staging = False
+        self.name_model, self.strength_model, self.ingredient_model, self.ndc_model = IMPORT_MODELS
+
+    def get_live_index_names(self, schema_editor, staging_model, model):
+        """Return the names Django gives to the indexes and constraints of a staging table on the table of the model.
+
+        Indexes are found by table, names longer than the database limit are shortened and lose the staging table name.
+        """
+        staging_table, table = staging_model._meta.db_table, model._meta.db_table
+        live_tables = {model._meta.db_table + STAGING_TABLE_SUFFIX: model._meta.db_table for model in IMPORT_MODELS}
+        trigram_columns = {
+            get_trigram_index_name(staging_table, column): column
+            for trigram_model, column in TRIGRAM_INDEXES
+            if trigram_model is model
+        }
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, staging_table)
+
+        names = {}
+        for name, constraint in constraints.items():
+            columns = constraint["columns"]
+            if name in trigram_columns:
+                names[name] = get_trigram_index_name(table, trigram_columns[name])
+            elif constraint["primary_key"]:
+                # named by PostgreSQL, SQLite primary keys have no index
+                names[name] = "{}_pkey".format(table)
+            elif constraint["foreign_key"]:
+                to_table, to_column = constraint["foreign_key"]
+                names[name] = schema_editor._create_index_name(
+                    table, columns, suffix="_fk_{}_{}".format(live_tables.get(to_table, to_table), to_column)
+                )
+            elif constraint["unique"] and len(columns) == 1:
+                # unique fields are created inline and named by PostgreSQL
+                names[name] = "{}_{}_key".format(table, columns[0])
+            elif constraint["unique"]:
+                names[name] = schema_editor._create_index_name(table, columns, suffix="_uniq")
+            elif constraint["index"]:
+                suffix = "_like" if name.endswith("_like") else ""
+                names[name] = schema_editor._create_index_name(table, columns, suffix=suffix)
+        return names
+
+    def rename_staging_indexes(self, schema_editor, staging_model, model, names):
+        """Rename indexes, constraints and the sequence of a staging table moved in place of the table of the model, so
+        the next staging tables can use their names"""
+        staging_table, table = staging_model._meta.db_table, model._meta.db_table
+        quote_name = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            if connection.vendor == "sqlite":
+                # SQLite cannot rename indexes
+                cursor.execute(
+                    "SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = %s AND sql IS NOT NULL",
+                    [table],
+                )
+                for name, sql in cursor.fetchall():
+                    if name in names and names[name] != name:
+                        schema_editor.execute("DROP INDEX {}".format(quote_name(name)))
+                        schema_editor.execute(sql.replace(quote_name(name), quote_name(names[name]), 1))
+                return
+
+            for name, constraint in connection.introspection.get_constraints(cursor, table).items():
+                if name not in names or names[name] == name:
+                    continue
+                if any(constraint[kind] for kind in ("primary_key", "unique", "foreign_key", "check")):
+                    sql = "ALTER TABLE {} RENAME CONSTRAINT {} TO {}".format(
+                        quote_name(table), quote_name(name), quote_name(names[name])
+                    )
+                else:
+                    sql = "ALTER INDEX {} RENAME TO {}".format(quote_name(name), quote_name(names[name]))
+                schema_editor.execute(sql)
+
+            if connection.vendor == "postgresql" and model._meta.pk.auto_created:
+                cursor.execute("SELECT pg_get_serial_sequence(%s, %s)", [table, model._meta.pk.column])
+                sequence = cursor.fetchone()[0]
+                if sequence and staging_table in sequence:
+                    new_name = sequence.split(".")[-1].strip('"').replace(staging_table, table)
+                    schema_editor.execute("ALTER SEQUENCE {} RENAME TO {}".format(sequence, quote_name(new_name)))
+
     def handle(self, *args, **options):
         # each product has following fields:
         # * PROPRIETARYNAME - name of the drug
@@ -65,50 +642,142 @@ class Command(BaseCommand):
         # * SUBSTANCENAME - names of the substances in the drug, e.g.: CLINDAMYCIN PHOSPHATE; TRETINOIN
         # * ACTIVE_NUMERATOR_STRENGTH - strengths of the substances, e.g.: 12; .25
         # * ACTIVE_INGRED_UNIT - units for the strengths e.g.: mg/g; mg/g
+        batch_size = options["batch_size"]
+        sync = options["sync"]
+        staging = options["staging"]
+        if sync and staging:
+            raise CommandError("--sync and --staging cannot be used together")
 
-        cache = {}
+        self.cache_metadata = None
+        self.inserted = Counter()
+        database_file = self.open_database_file(options["file"], force=options["force"])
+        if database_file is None:
+            print("NDC database did not change since the last import, use --force to import it anyway.")
+            return
 
-        def cached_get_or_create(key, model, defaults=None, **kwargs):
-            try:
-                return cache[key], False
-            except KeyError:
-                obj, created = model.objects.get_or_create(defaults=defaults, **kwargs)
-                cache[key] = obj
-                return obj, created
-
-        products_data = self.get_products_data()
-        skipped = 0
-        for i, product in enumerate(products_data):
-            if (i % 100) == 0:
-                print("\rrow {}".format(i), end="", flush=True)
-            if product["NDC_EXCLUDE_FLAG"] != "N":
-                skipped += 1
-                continue
-            product_name = "{} {}".format(
-                product["PROPRIETARYNAME"].strip(),
-                product["PROPRIETARYNAMESUFFIX"].strip(),
-            ).strip()
-            strength_data = self.get_medication_strength_data(product)
-            medication_name, created = cached_get_or_create(
-                "name:{}".format(product_name),
-                MedicationName,
-                name=product_name,
-                defaults={"active_substances": list(strength_data.keys())},
+        stats = {"rows": 0, "skipped": 0, "inserted": 0, "updated": 0}
+        # fingerprints of NDCs saved in the database as digests, the ones left after reading the file are deleted;
+        # kept for the whole run, unlike model instances and strength ids which only live for a batch
+        fingerprints = (
+            {
+                ndc: unhexlify(fingerprint)
+                for ndc, fingerprint in MedicationNDC.objects.values_list("ndc", "fingerprint").iterator()
+            }
+            if sync
+            else {}
+        )
+
+        # seconds spent in each stage, parsing is the sum of the time of the workers
+        stage_stats = {"reader": 0.0, "parser": 0.0, "writer": 0.0}
+
+        # NDCs read by a synchronisation, the first row of a repeated NDC is saved as with a full import
+        seen_ndcs = set()
+        # active substances of the first product of each name read by a synchronisation, see save_names
+        self.name_substances = {}
+
+        def get_products(products):
+            for product in products:
+                if sync:
+                    if product.ndc in seen_ndcs:
+                        continue
+                    seen_ndcs.add(product.ndc)
+                    self.name_substances.setdefault(product.name, list(product.strength.keys()))
+                    fingerprint = fingerprints.pop(product.ndc, None)
+                    if fingerprint == unhexlify(product.fingerprint):
+                        continue
+                    stats["inserted" if fingerprint is None else "updated"] += 1
+                yield product
+
+        # a full import into the medications tables saves its progress with each batch, the next run of the same
+        # archive continues after the last committed batch; a synchronisation skips saved products anyway
+        archive_hash = get_file_sha256(database_file) if not sync and not staging else None
+        skip_rows = self.get_checkpoint_rows(archive_hash) if archive_hash and options["resume"] else 0
+        if skip_rows:
+            print("Resuming the interrupted import after row {}".format(skip_rows))
+        stats["rows"] = skip_rows
+
+        start = time.monotonic()
+        changed_names, changed_strength_ids, changed_ndcs = set(), set(), set()
+        saved = 0
+        # the medications tables are not changed until the staging tables are complete
+        index_sql = self.create_staging_tables() if staging else None
+        try:
+            for products, rows, skipped, seconds in self.get_parsed_batches(
+                database_file, batch_size, options["workers"], stage_stats, skip_rows
+            ):
+                stats["rows"] += rows
+                stats["skipped"] += skipped
+                stage_stats["parser"] += seconds
+                products = list(get_products(products))
+
+                write_start = time.monotonic()
+                strength_ids = set()
+                if products or archive_hash:
+                    with transaction.atomic():
+                        if products:
+                            strength_ids = self.save_products(products, batch_size, update=sync)
+                        if archive_hash:
+                            self.save_checkpoint(archive_hash, stats["rows"])
+                stage_stats["writer"] += time.monotonic() - write_start
+                saved += len(products)
+                if sync:
+                    changed_names.update(product.name for product in products)
+                    changed_strength_ids.update(strength_ids)
+                    changed_ndcs.update(product.ndc for product in products)
+                print("\rrow {}".format(stats["rows"]), end="", flush=True)
+            if staging:
+                self.replace_with_staging_tables(index_sql)
+        except BaseException:
+            if staging:
+                self.drop_staging_tables()
+            raise
+
+        summary = "{} rows, {} excluded drugs".format(stats["rows"], stats["skipped"])
+        if staging and is_es_enabled():
+            # the indexes are built again from the replaced tables
+            EsSearchAPI().index_medications()
+        if sync:
+            deleted_names, deleted_strength_ids, deleted_ndc_ids = [], [], []
+            if fingerprints or changed_ndcs:
+                # updated NDCs may leave their previous strengths without NDCs
+                deleted_names, deleted_strength_ids, deleted_ndc_ids = self.delete_products(
+                    list(fingerprints), batch_size
+                )
+                if is_es_enabled():
+                    es = EsSearchAPI()
+                    es.delete_medications(deleted_names, deleted_strength_ids, deleted_ndc_ids)
+                    es.index_changed_medications(
+                        changed_names, changed_strength_ids - set(deleted_strength_ids), changed_ndcs
+                    )
+            summary += ", {} inserted, {} updated, {} deleted".format(
+                stats["inserted"], stats["updated"], len(deleted_ndc_ids)
             )
-            medication_strength, created = cached_get_or_create(
-                "strength:{}-{}".format(medication_name.name, strength_data),
-                MedicationStrength,
-                medication_name=medication_name,
-                strength=strength_data,
+
+        if archive_hash:
+            ImportCheckpoint.objects.filter(pk=1).delete()
+        if self.cache_metadata:
+            self.save_cache_metadata(self.cache_metadata)
+        # the data version is kept when a synchronisation did not change anything, so HTTP caches stay valid
+        if not sync or fingerprints or changed_ndcs:
+            invalidate_autocomplete_cache()
+
+        elapsed = time.monotonic() - start
+        print(
+            "\rDone.  {}, {:.0f} rows/s".format(
+                summary, stats["rows"] / elapsed if elapsed else 0
             )
-            ndc = product["PRODUCTNDC"]
-            cached_get_or_create(
-                "ndc:{}".format(ndc),
-                MedicationNDC,
-                ndc=ndc,
-                defaults={
-                    "medication_strength": medication_strength,
-                    "manufacturer": product["LABELERNAME"],
-                },
+        )
+        for stage, count, unit in (
+            ("reader", stats["rows"], "rows"),
+            ("parser", stats["rows"], "rows"),
+            ("writer", saved, "products"),
+        ):
+            seconds = stage_stats[stage]
+            print(
+                "{}: {} {} in {:.1f} s, {:.0f} {}/s".format(
+                    stage, count, unit, seconds, count / seconds if seconds else 0, unit
+                )
             )
-        print("\rDone.  {} rows, {} excluded drugs".format(i, skipped))
+        peak_memory = get_peak_memory()
+        if peak_memory is not None:
+            print("peak memory: {:.1f} MiB".format(peak_memory / 1024 / 1024))
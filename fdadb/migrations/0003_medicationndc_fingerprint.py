@@ -0,0 +1,18 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fdadb', '0002_auto_20190904_1512'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicationndc',
+            name='fingerprint',
+            field=models.CharField(blank=True, default='', help_text='Hash of the product data used for incremental imports', max_length=40),
+        ),
+    ]
@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# icontains lookups on PostgreSQL compare UPPER("column"::text), the indexes use the same expression
+TRIGRAM_INDEXES = (
+    ("fdadb_medicationname", "name"),
+    ("fdadb_medicationstrength", "strength"),
+    ("fdadb_medicationndc", "manufacturer"),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            'CREATE INDEX IF NOT EXISTS "{table}_{column}_trgm" ON "{table}" '
+            'USING gin (UPPER("{column}"::text) gin_trgm_ops)'.format(table=table, column=column)
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    for table, column in TRIGRAM_INDEXES:
+        schema_editor.execute('DROP INDEX IF EXISTS "{table}_{column}_trgm"'.format(table=table, column=column))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fdadb', '0003_medicationndc_fingerprint'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,87 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:27
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def get_strength_search_string(strength):
+    return ", ".join("{} {} {}".format(key, value["strength"], value["unit"]) for key, value in strength.items())
+
+
+def backfill_strengths(apps, schema_editor):
+    MedicationStrength = apps.get_model("fdadb", "MedicationStrength")
+    MedicationStrengthIngredient = apps.get_model("fdadb", "MedicationStrengthIngredient")
+
+    last_pk = 0
+    while True:
+        strengths = list(
+            MedicationStrength.objects.filter(pk__gt=last_pk).order_by("pk").only("pk", "strength")[:BATCH_SIZE]
+        )
+        if not strengths:
+            break
+
+        for medication_strength in strengths:
+            medication_strength.strength_search = get_strength_search_string(medication_strength.strength)
+        MedicationStrength.objects.bulk_update(strengths, ["strength_search"])
+        MedicationStrengthIngredient.objects.bulk_create(
+            MedicationStrengthIngredient(
+                medication_strength_id=medication_strength.pk,
+                substance=substance,
+                strength=value["strength"],
+                unit=value["unit"],
+            )
+            for medication_strength in strengths
+            for substance, value in medication_strength.strength.items()
+        )
+        last_pk = strengths[-1].pk
+
+
+def move_strength_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS "fdadb_medicationstrength_strength_trgm"')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS "fdadb_medicationstrength_strength_search_trgm" ON "fdadb_medicationstrength" '
+        'USING gin (UPPER("strength_search"::text) gin_trgm_ops)'
+    )
+
+
+def restore_strength_trigram_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "postgresql":
+        return
+
+    schema_editor.execute('DROP INDEX IF EXISTS "fdadb_medicationstrength_strength_search_trgm"')
+    schema_editor.execute(
+        'CREATE INDEX IF NOT EXISTS "fdadb_medicationstrength_strength_trgm" ON "fdadb_medicationstrength" '
+        'USING gin (UPPER("strength"::text) gin_trgm_ops)'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fdadb', '0004_trigram_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicationstrength',
+            name='strength_search',
+            field=models.TextField(blank=True, default='', help_text='Strength as searched text, set on save'),
+        ),
+        migrations.CreateModel(
+            name='MedicationStrengthIngredient',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('substance', models.CharField(db_index=True, max_length=255)),
+                ('strength', models.CharField(max_length=255)),
+                ('unit', models.CharField(max_length=255)),
+                ('medication_strength', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ingredients', to='fdadb.medicationstrength')),
+            ],
+        ),
+        migrations.RunPython(backfill_strengths, migrations.RunPython.noop),
+        migrations.RunPython(move_strength_trigram_index, restore_strength_trigram_index),
+    ]
@@ -0,0 +1,64 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:46
+
+import hashlib
+import json
+
+from django.db import migrations, models
+
+BATCH_SIZE = 1000
+
+
+def get_strength_hash(strength):
+    return hashlib.sha1(json.dumps(strength, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def backfill_strength_hashes(apps, schema_editor):
+    """Set hashes of strengths and merge strengths of a name with the same payload into the first one"""
+    MedicationStrength = apps.get_model("fdadb", "MedicationStrength")
+    MedicationNDC = apps.get_model("fdadb", "MedicationNDC")
+
+    strength_ids = {}
+    duplicates = {}
+    last_pk = 0
+    while True:
+        strengths = list(
+            MedicationStrength.objects.filter(pk__gt=last_pk)
+            .order_by("pk")
+            .only("pk", "medication_name_id", "strength")[:BATCH_SIZE]
+        )
+        if not strengths:
+            break
+
+        unique_strengths = []
+        for medication_strength in strengths:
+            medication_strength.strength_hash = get_strength_hash(medication_strength.strength)
+            key = (medication_strength.medication_name_id, medication_strength.strength_hash)
+            if key in strength_ids:
+                duplicates[medication_strength.pk] = strength_ids[key]
+            else:
+                strength_ids[key] = medication_strength.pk
+                unique_strengths.append(medication_strength)
+        MedicationStrength.objects.bulk_update(unique_strengths, ["strength_hash"])
+        last_pk = strengths[-1].pk
+
+    for duplicate_pk, pk in duplicates.items():
+        MedicationNDC.objects.filter(medication_strength_id=duplicate_pk).update(medication_strength_id=pk)
+    duplicate_pks = list(duplicates)
+    for i in range(0, len(duplicate_pks), BATCH_SIZE):
+        MedicationStrength.objects.filter(pk__in=duplicate_pks[i:i + BATCH_SIZE]).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fdadb', '0006_dataversion'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='medicationstrength',
+            name='strength_hash',
+            field=models.CharField(blank=True, default='', help_text='Hash of the strength identifying it for a name, set on save', max_length=40),
+        ),
+        migrations.RunPython(backfill_strength_hashes, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:46
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fdadb', '0007_medicationstrength_strength_hash'),
+    ]
+
+    operations = [
+        migrations.AlterUniqueTogether(
+            name='medicationstrength',
+            unique_together={('medication_name', 'strength_hash')},
+        ),
+    ]
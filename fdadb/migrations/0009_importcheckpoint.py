@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-18 13:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('fdadb', '0008_medicationstrength_unique_strength_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ImportCheckpoint',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('archive_hash', models.CharField(help_text='SHA-256 of the imported NDC database archive', max_length=64)),
+                ('rows', models.PositiveIntegerField(default=0, help_text='Rows of product.txt saved by committed batches')),
+                ('updated', models.DateTimeField(help_text='Time of the last committed batch')),
+            ],
+        ),
+    ]
@@ -1,6 +1,13 @@
 from django.db import models
 from django_extensions.db.fields.json import JSONField
 
+from fdadb.ndc_parser import get_strength_hash
+
+
+def get_strength_search_string(strength):
+    """Return the strength as text searched by the API, e.g.: Sildenafil 3 mg/1"""
+    return ", ".join("{} {} {}".format(key, value["strength"], value["unit"]) for key, value in strength.items())
+
 
 class MedicationName(models.Model):
     name = models.CharField(primary_key=True, max_length=255, help_text="Commercial Name (e.g. Viagra)")
@@ -28,6 +35,18 @@ class MedicationStrength(models.Model):
     """
     medication_name = models.ForeignKey("MedicationName", on_delete=models.CASCADE, related_name="strengths")
     strength = JSONField(default={}, blank=True, help_text=STRENGTH_HELP_TEXT)
+    strength_search = models.TextField(blank=True, default="", help_text="Strength as searched text, set on save")
+    strength_hash = models.CharField(
+        max_length=40, blank=True, default="", help_text="Hash of the strength identifying it for a name, set on save"
+    )
+
+    class Meta:
+        unique_together = (("medication_name", "strength_hash"),)
+
+    def save(self, *args, **kwargs):
+        self.strength_search = get_strength_search_string(self.strength)
+        self.strength_hash = get_strength_hash(self.strength)
+        super().save(*args, **kwargs)
 
     @property
     def name(self):
@@ -38,10 +57,27 @@ class MedicationStrength(models.Model):
         return self.medication_name.active_substances
 
 
+class MedicationStrengthIngredient(models.Model):
+    """Strength of a single active substance, saved by fetch_ndc_database"""
+
+    medication_strength = models.ForeignKey(
+        "MedicationStrength", on_delete=models.CASCADE, related_name="ingredients"
+    )
+    substance = models.CharField(max_length=255, db_index=True)
+    strength = models.CharField(max_length=255)
+    unit = models.CharField(max_length=255)
+
+    def __str__(self):
+        return "{} {} {}".format(self.substance, self.strength, self.unit)
+
+
 class MedicationNDC(models.Model):
     medication_strength = models.ForeignKey("MedicationStrength", on_delete=models.CASCADE, related_name="ndcs")
     ndc = models.CharField(max_length=12, unique=True, db_index=True)
     manufacturer = models.CharField(max_length=255, db_index=True)
+    fingerprint = models.CharField(
+        max_length=40, blank=True, default="", help_text="Hash of the product data used for incremental imports"
+    )
 
     def __str__(self):
         return self.ndc
@@ -57,3 +93,24 @@ class MedicationNDC(models.Model):
     @property
     def strength(self):
         return self.medication_strength.strength
+
+
+class DataVersion(models.Model):
+    """Version of the medications data, a single row changed after each import and indexing"""
+
+    version = models.CharField(max_length=32)
+    updated = models.DateTimeField(help_text="Time of the last import or indexing")
+
+    def __str__(self):
+        return self.version
+
+
+class ImportCheckpoint(models.Model):
+    """Progress of an unfinished import of the NDC database, a single row removed once the import is finished"""
+
+    archive_hash = models.CharField(max_length=64, help_text="SHA-256 of the imported NDC database archive")
+    rows = models.PositiveIntegerField(default=0, help_text="Rows of product.txt saved by committed batches")
+    updated = models.DateTimeField(help_text="Time of the last committed batch")
+
+    def __str__(self):
+        return "{} rows of {}".format(self.rows, self.archive_hash)
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""Parsing of the NDC database products, without Django imports so it can run in worker processes of the import"""
+import hashlib
+import json
+import time
+from collections import OrderedDict, namedtuple
+
+Product = namedtuple("Product", ["name", "strength", "strength_hash", "ndc", "manufacturer", "fingerprint"])
+
+
+def strip_list_items(items):
+    """Apply str.strip to all items in a list"""
+    return list(map(str.strip, items))
+
+
+def get_strength_hash(strength):
+    """Return a hash of the strength payload, independent of the order of substances"""
+    return hashlib.sha1(json.dumps(strength, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def product_fingerprint(name, strength, manufacturer):
+    """Return a hash of the product data saved in the database"""
+    return hashlib.sha1(
+        json.dumps([name, strength, manufacturer], sort_keys=True).encode("utf-8")
+    ).hexdigest()
+
+
+def get_medication_strength_data(product_data):
+    # some product does not provide substance name
+    substance_name = product_data["SUBSTANCENAME"]
+    if not substance_name:
+        return {}
+
+    active_substances = strip_list_items(substance_name.split(";"))
+    substances_strength = strip_list_items(
+        product_data["ACTIVE_NUMERATOR_STRENGTH"].split(";")
+    )
+    substances_units = strip_list_items(
+        product_data["ACTIVE_INGRED_UNIT"].split(";")
+    )
+    return OrderedDict(
+        (substance, {"strength": strength, "unit": unit})
+        for substance, strength, unit in zip(
+            active_substances, substances_strength, substances_units
+        )
+    )
+
+
+def get_product_name(product_data):
+    return "{} {}".format(
+        product_data["PROPRIETARYNAME"].strip(),
+        product_data["PROPRIETARYNAMESUFFIX"].strip(),
+    ).strip()
+
+
+def get_product(product_data):
+    name = get_product_name(product_data)
+    strength = get_medication_strength_data(product_data)
+    manufacturer = product_data["LABELERNAME"]
+    return Product(
+        name=name,
+        strength=strength,
+        strength_hash=get_strength_hash(strength),
+        ndc=product_data["PRODUCTNDC"],
+        manufacturer=manufacturer,
+        fingerprint=product_fingerprint(name, strength, manufacturer),
+    )
+
+
+def parse_products(rows):
+    """Return products of a batch of product.txt rows, the number of rows, excluded rows and seconds it took.
+
+    Excluded drugs and repeated NDCs are left out, the first row of an NDC is the one saved in the database.
+    """
+    start = time.monotonic()
+    products = OrderedDict()
+    skipped = 0
+    for product_data in rows:
+        if product_data["NDC_EXCLUDE_FLAG"] != "N":
+            skipped += 1
+            continue
+        if product_data["PRODUCTNDC"] not in products:
+            products[product_data["PRODUCTNDC"]] = get_product(product_data)
+    return list(products.values()), len(rows), skipped, time.monotonic() - start
@@ -0,0 +1,116 @@
+# -*- coding: utf-8 -*-
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import CursorPagination, LimitOffsetPagination, PageNumberPagination
+
+# default index.max_result_window of ElasticSearch, the largest from + size of a search
+ES_MAX_RESULT_WINDOW = 10000
+
+
+class EsSearchResults(object):
+    """Lazy ElasticSearch results, counted and sliced by the DRF paginators like a queryset.
+
+    `search` is called with offset and size and returns the total count and the results. The paginators set the window
+    of the requested page in advance, so a page is fetched with a single search request. Unpaginated results list at
+    most `max_size` results (all of them with None). Windows past `max_window` (ElasticSearch refuses searches with
+    from + size above index.max_result_window) are cut short, or not found when they start past it.
+    """
+
+    def __init__(self, search, size=10, max_size=ES_MAX_RESULT_WINDOW, max_window=ES_MAX_RESULT_WINDOW):
+        self.search = search
+        self.max_size = max_size
+        self.max_window = max_window
+        self.set_window(0, size)
+
+    def set_window(self, offset, size):
+        self._offset, self._size = offset, size
+        self._count = self._results = None
+
+    def _fetch(self, offset, size):
+        self._offset, self._size = offset, size
+        if self.max_window is not None and offset + size > self.max_window:
+            if offset >= self.max_window:
+                raise NotFound("Only the first {} results are available.".format(self.max_window))
+            size = self.max_window - offset
+        self._count, self._results = self.search(offset, size)
+
+    def count(self):
+        if self._count is None:
+            self._fetch(self._offset, self._size)
+        return self._count
+
+    def fetch_all(self):
+        """Set the window to all results (at most `max_size`), listed when the results are not paginated"""
+        size = self.count() if self.max_size is None else min(self.count(), self.max_size)
+        if self._offset or size > self._size:
+            self.set_window(0, size)
+
+    def __len__(self):
+        return self.count()
+
+    def __iter__(self):
+        self.count()
+        return iter(self._results)
+
+    def __getitem__(self, item):
+        if not isinstance(item, slice):
+            return self[item:item + 1][0]
+
+        start = item.start or 0
+        stop = item.stop if item.stop is not None else self.count()
+        # the last page of PageNumberPagination is shorter than the window
+        if self._results is None or start != self._offset or stop > self._offset + self._size:
+            self._fetch(start, max(stop - start, 0))
+        return self._results[:stop - start]
+
+
+class EsPaginationMixin(object):
+    def get_es_window(self, request):
+        raise NotImplementedError
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if isinstance(queryset, EsSearchResults):
+            window = self.get_es_window(request)
+            if window:
+                queryset.set_window(*window)
+        page = super().paginate_queryset(queryset, request, view)
+        if page is None and isinstance(queryset, EsSearchResults):
+            # no page size, all results are listed as with a queryset
+            queryset.fetch_all()
+        return page
+
+
+class EsLimitOffsetPagination(EsPaginationMixin, LimitOffsetPagination):
+    """LimitOffsetPagination translating limit and offset into ElasticSearch from/size"""
+
+    def get_es_window(self, request):
+        limit = self.get_limit(request)
+        return limit and (self.get_offset(request), limit)
+
+
+class EsPageNumberPagination(EsPaginationMixin, PageNumberPagination):
+    """PageNumberPagination translating the page into ElasticSearch from/size"""
+
+    def get_es_window(self, request):
+        page_size = self.get_page_size(request)
+        if not page_size:
+            return None
+        try:
+            page_number = max(int(request.query_params.get(self.page_query_param, 1)), 1)
+        except ValueError:
+            # e.g. "last", the page is fetched once the count is known
+            return None
+        return (page_number - 1) * page_size, page_size
+
+
+class KeysetPagination(CursorPagination):
+    """Cursor pagination on the primary key: no counts or offsets, each page is a `WHERE id > ...` query.
+
+    New rows get higher ids and removed rows do not move the following ones, so cursors stay valid during imports
+    (``--staging`` imports keep the ids of saved rows as well).
+    """
+
+    ordering = "id"
+
+
+class NameKeysetPagination(KeysetPagination):
+    ordering = "name"
@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+import re
+import threading
+from array import array
+from bisect import bisect_left
+
+from fdadb.cache import get_data_version
+from fdadb.models import MedicationName
+
+WORD_RE = re.compile(r"\w+")
+
+
+def tokenize(text):
+    return WORD_RE.findall(text.lower())
+
+
+class PrefixSearchIndex(object):
+    """In-memory index answering prefix queries on medication names.
+
+    Names and their words are kept in sorted lists, a query is answered with binary searches on them. A name matches
+    when every word of the query is a prefix of one of its words, names starting with the query are ranked first.
+    `active_substances` of the names are kept with them, so results are served without querying the database.
+    """
+
+    def __init__(self, names, active_substances=None):
+        self.names = sorted(names, key=str.lower)
+        self.active_substances = active_substances or {}
+        self.lower_names = [name.lower() for name in self.names]
+
+        words = sorted((word, i) for i, name in enumerate(self.lower_names) for word in set(tokenize(name)))
+        self.words = [word for word, i in words]
+        self.word_name_ids = array("I", (i for word, i in words))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _get_name_ids(self, prefix):
+        start = bisect_left(self.words, prefix)
+        end = bisect_left(self.words, prefix + "\uffff", lo=start)
+        return set(self.word_name_ids[start:end])
+
+    def search(self, q, limit=10):
+        """Return up to `limit` names matching the query, best matches first"""
+        query_words = tokenize(q or "")
+        if not query_words:
+            return self.names[:limit]
+
+        # start with the most selective word, the longest one
+        query_words.sort(key=len, reverse=True)
+        name_ids = self._get_name_ids(query_words[0])
+        for word in query_words[1:]:
+            if not name_ids:
+                break
+            name_ids &= self._get_name_ids(word)
+
+        query = " ".join(tokenize(q))
+        name_ids = sorted(name_ids, key=lambda i: (not self.lower_names[i].startswith(query), i))
+        return [self.names[i] for i in name_ids[:limit]]
+
+
+_index = None
+_index_version = None
+_index_lock = threading.Lock()
+
+
+def get_prefix_search_index():
+    """Return the index of medication names, built again when the data version changes"""
+    global _index, _index_version
+    version = get_data_version()
+    if _index_version != version:
+        with _index_lock:
+            if _index_version != version:
+                active_substances = dict(MedicationName.objects.values_list("name", "active_substances").iterator())
+                _index = PrefixSearchIndex(active_substances, active_substances)
+                _index_version = version
+    return _index
+
+
+def search_names(q, limit=10):
+    """Return rows (like `values()` rows) of medication names matching the query, in the order of the ranking"""
+    index = get_prefix_search_index()
+    return [
+        {"name": name, "active_substances": index.active_substances.get(name, [])} for name in index.search(q, limit)
+    ]
@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+from rest_framework.renderers import JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class ORJSONRenderer(JSONRenderer):
+    """JSON renderer using orjson, requires the orjson package"""
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        # types orjson does not know (e.g. Decimal, lazy strings) are encoded like in the default renderer
+        return orjson.dumps(data, default=JSONEncoder().default)
@@ -1,9 +1,14 @@
 # -*- coding: utf-8 -*-
+from django.conf import settings
 from drf_tweaks.serializers import ModelSerializer
-from rest_framework.fields import CharField
+from rest_framework.exceptions import ValidationError
+from rest_framework.fields import CharField, ChoiceField, IntegerField
+from rest_framework.serializers import BaseSerializer, Serializer
 
 from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
 
+BATCH_MAX_QUERIES = getattr(settings, "FDADB_BATCH_MAX_QUERIES", 50)
+
 
 class JSONField(CharField):
     type_name = "JSONField"
@@ -39,3 +44,53 @@ class MedicationNDCSerializer(ModelSerializer):
     class Meta:
         model = MedicationNDC
         fields = ["name", "active_substances", "strength", "manufacturer", "ndc"]
+
+
+class FastSerializer(BaseSerializer):
+    """Read-only serializer copying `field_names` from dicts (`values()` rows, ElasticSearch documents) or objects,
+    without the fields machinery of model serializers"""
+
+    field_names = ()
+
+    def to_representation(self, instance):
+        if isinstance(instance, dict):
+            return {field: instance[field] for field in self.field_names}
+        return {field: getattr(instance, field) for field in self.field_names}
+
+
+class FastMedicationNameSerializer(FastSerializer):
+    field_names = MedicationNameSerializer.Meta.fields
+
+
+class FastMedicationStrengthSerializer(FastSerializer):
+    field_names = MedicationStrengthSerializer.Meta.fields
+
+
+class FastMedicationNDCSerializer(FastSerializer):
+    field_names = MedicationNDCSerializer.Meta.fields
+
+
+class BatchSearchQuerySerializer(Serializer):
+    REQUIRED_FIELDS = {"name": (), "strength": ("name",), "ndc": ("name", "strength_id")}
+
+    type = ChoiceField(choices=("name", "strength", "ndc"))
+    q = CharField(required=False, allow_blank=True)
+    name = CharField(required=False)
+    strength_id = IntegerField(required=False)
+    size = IntegerField(required=False, min_value=1, max_value=100)
+
+    def validate(self, attrs):
+        required_fields = self.REQUIRED_FIELDS[attrs["type"]]
+        errors = {field: "This field is required." for field in required_fields if attrs.get(field) is None}
+        if errors:
+            raise ValidationError(errors)
+        return attrs
+
+
+class BatchSearchSerializer(Serializer):
+    queries = BatchSearchQuerySerializer(many=True)
+
+    def validate_queries(self, queries):
+        if len(queries) > BATCH_MAX_QUERIES:
+            raise ValidationError("Ensure this field has no more than {} elements.".format(BATCH_MAX_QUERIES))
+        return queries
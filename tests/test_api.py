@@ -1,11 +1,22 @@
+import json
+from unittest import mock
+
+from django.db import connection
+from django.test import override_settings
+from django.test.utils import CaptureQueriesContext
 from rest_framework.reverse import reverse
 from rest_framework.test import APITestCase
 
+from fdadb.cache import invalidate_autocomplete_cache
+from fdadb.es_search import reset_es_client
 from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+from fdadb.pagination import EsLimitOffsetPagination, EsPageNumberPagination
+from tests.test_utils import BaseTestCase
 
 
-class APITests(APITestCase):
+class APITests(BaseTestCase):
     def setUp(self):
+        invalidate_autocomplete_cache()
         for name in ("DrugName", "OtherDrugName", "DruuuugName", "NamedDrug"):
             medication_name = MedicationName.objects.create(
                 name=name, active_substances=[name + " Substance 1", name + " Substance 2"]
@@ -27,6 +38,19 @@ class APITests(APITestCase):
                         manufacturer=manufacturer,
                     )
 
+    def test_query_counts(self):
+        # a count and a single query for the page, related objects are joined
+        self.assertEndpointQueries(reverse("fdadb-medications-names"), 2)
+        self.assertEndpointQueries(reverse("fdadb-medications-names") + "?q=drug", 1)
+        self.assertEndpointQueries(reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"}), 2)
+        self.assertEndpointQueries(
+            reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"}) + "?q=substance", 2
+        )
+        strength = MedicationStrength.objects.filter(medication_name="DrugName").first()
+        url = reverse("fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": strength.pk})
+        self.assertEndpointQueries(url, 2)
+        self.assertEndpointQueries(url + "?q=m1", 2)
+
     def test_names_api(self):
         url = reverse("fdadb-medications-names")
         response = self.client.get(url)
@@ -117,3 +141,386 @@ class APITests(APITestCase):
         )
         self.assertEqual(response.data["results"][0]["manufacturer"], "M2")
         self.assertEqual(response.data["results"][0]["ndc"], "Other1M2")
+
+
+def fake_es_search(documents):
+    def search(index, body):
+        hits = documents[body["from"]:body["from"] + body["size"]]
+        return {
+            "hits": {
+                "total": {"value": len(documents), "relation": "eq"},
+                "hits": [{"_source": dict(doc)} for doc in hits],
+            }
+        }
+
+    return search
+
+
+@override_settings(TESTING=False, ELASTICSEARCH_URL="http://localhost:9200")
+class EsAPITests(APITestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        reset_es_client()
+        self.addCleanup(reset_es_client)
+        patcher = mock.patch("fdadb.es_search.Elasticsearch")
+        self.es = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    def test_names_api(self):
+        self.es.search.side_effect = fake_es_search(
+            [{"name": "Drug {}".format(i), "active_substances": ["Substance"]} for i in range(25)]
+        )
+        url = reverse("fdadb-medications-names")
+        response = self.client.get(url + "?q=drug&limit=5&offset=20")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 25)
+        self.assertEqual(
+            [item["name"] for item in response.data["results"]], ["Drug {}".format(i) for i in range(20, 25)]
+        )
+        self.assertIsNone(response.data["next"])
+        self.es.search.assert_called_once_with(
+            index="fda_medications_names",
+            body={"query": {"match": {"name": "drug"}}, "from": 20, "size": 5, "track_total_hits": True},
+        )
+
+    def test_max_result_window(self):
+        self.es.search.side_effect = fake_es_search(
+            [{"name": "Drug {}".format(i), "active_substances": ["Substance"]} for i in range(10010)]
+        )
+        url = reverse("fdadb-medications-names")
+        response = self.client.get(url + "?limit=10&offset=9995")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 10010)
+        self.assertEqual(len(response.data["results"]), 5)
+        body = self.es.search.call_args[1]["body"]
+        self.assertEqual((body["from"], body["size"]), (9995, 5))
+
+        self.es.search.reset_mock()
+        response = self.client.get(url + "?limit=10&offset=10000")
+        self.assertEqual(response.status_code, 404)
+        self.es.search.assert_not_called()
+
+        response = self.client.get(
+            reverse("fdadb-medications-strengths", kwargs={"medication_name": "NamedDrug"}) + "?page=1001"
+        )
+        self.assertEqual(response.status_code, 404)
+        self.es.search.assert_not_called()
+
+    @mock.patch.object(EsPageNumberPagination, "page_size", None)
+    @mock.patch.object(EsLimitOffsetPagination, "default_limit", None)
+    def test_not_paginated(self):
+        self.es.search.side_effect = fake_es_search(
+            [
+                {
+                    "id": i,
+                    "name": "NamedDrug",
+                    "active_substances": json.dumps(["Substance"]),
+                    "strength": json.dumps({"Substance": {"strength": str(i), "unit": "mg/l"}}),
+                }
+                for i in range(25)
+            ]
+        )
+        response = self.client.get(reverse("fdadb-medications-strengths", kwargs={"medication_name": "NamedDrug"}))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["strength"]["Substance"]["strength"] for item in response.data], [str(i) for i in range(25)]
+        )
+
+        self.es.search.side_effect = fake_es_search(
+            [{"name": "Drug {}".format(i), "active_substances": ["Substance"]} for i in range(25)]
+        )
+        with mock.patch("fdadb.api.AUTOCOMPLETE_LIMIT", 20):
+            response = self.client.get(reverse("fdadb-medications-names") + "?q=drug")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data), 20)
+
+    def test_strengths_api(self):
+        self.es.search.side_effect = fake_es_search(
+            [
+                {
+                    "id": i,
+                    "name": "NamedDrug",
+                    "active_substances": json.dumps(["Substance"]),
+                    "strength": json.dumps({"Substance": {"strength": str(i), "unit": "mg/l"}}),
+                }
+                for i in range(15)
+            ]
+        )
+        url = reverse("fdadb-medications-strengths", kwargs={"medication_name": "NamedDrug"})
+        response = self.client.get(url + "?q=mg&page=2")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 15)
+        self.assertEqual(len(response.data["results"]), 5)
+        self.assertEqual(response.data["results"][0]["active_substances"], ["Substance"])
+        self.assertEqual(response.data["results"][0]["strength"], {"Substance": {"strength": "10", "unit": "mg/l"}})
+        self.assertIsNotNone(response.data["previous"])
+        self.es.search.assert_called_once()
+        body = self.es.search.call_args[1]["body"]
+        self.assertEqual((body["from"], body["size"]), (10, 10))
+        self.assertEqual(body["query"]["bool"]["must"], {"match": {"strength_search_string": "mg"}})
+
+    def test_ndcs_api(self):
+        self.es.search.side_effect = fake_es_search(
+            [
+                {
+                    "id": i,
+                    "name": "OtherDrugName",
+                    "active_substances": json.dumps(["Substance"]),
+                    "strength": json.dumps({"Substance": {"strength": "1", "unit": "mg/l"}}),
+                    "strength_id": 7,
+                    "ndc": "0001-{}".format(i),
+                    "manufacturer": "M{}".format(i),
+                }
+                for i in range(3)
+            ]
+        )
+        url = reverse("fdadb-medications-ndcs", kwargs={"medication_name": "OtherDrugName", "strength_id": 7})
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data["count"], 3)
+        self.assertEqual([item["ndc"] for item in response.data["results"]], ["0001-0", "0001-1", "0001-2"])
+        self.assertEqual(response.data["results"][0]["manufacturer"], "M0")
+        self.es.search.assert_called_once()
+        body = self.es.search.call_args[1]["body"]
+        self.assertEqual(
+            body["query"]["bool"]["filter"], [{"term": {"name": "OtherDrugName"}}, {"term": {"strength_id": "7"}}]
+        )
+
+
+@mock.patch("fdadb.api.CURSOR_PAGINATION", True)
+class CursorPaginationAPITests(BaseTestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        medication_name = MedicationName.objects.create(name="DrugName", active_substances=["Substance"])
+        for strength in range(15):
+            medication_strength = MedicationStrength.objects.create(
+                medication_name=medication_name, strength={"Substance": {"strength": strength, "unit": "mg/l"}}
+            )
+        self.strength = medication_strength
+        for i in range(25):
+            MedicationNDC.objects.create(medication_strength=medication_strength, ndc="N{}".format(i), manufacturer="M")
+        for i in range(12):
+            MedicationName.objects.create(name="Name {:02d}".format(i), active_substances=[])
+
+    def test_ndcs_api(self):
+        url = reverse("fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": self.strength.pk})
+        ndcs = []
+        while url:
+            with CaptureQueriesContext(connection) as queries:
+                response = self.assertEndpointQueries(url, 1)
+            self.assertNotIn("count", response.data)
+            self.assertIn("LIMIT 11", queries[0]["sql"])
+            self.assertNotIn("OFFSET", queries[0]["sql"])
+            ndcs.extend(item["ndc"] for item in response.data["results"])
+            url = response.data["next"]
+            # removing rows already returned does not shift the next pages
+            MedicationNDC.objects.filter(ndc="N0").delete()
+        self.assertEqual(ndcs, ["N{}".format(i) for i in range(25)])
+
+    def test_strengths_api(self):
+        url = reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"})
+        response = self.client.get(url)
+        self.assertEqual(len(response.data["results"]), 10)
+        response = self.client.get(response.data["next"])
+        self.assertEqual(
+            [item["strength"]["Substance"]["strength"] for item in response.data["results"]], [10, 11, 12, 13, 14]
+        )
+        self.assertIsNone(response.data["next"])
+
+    def test_names_api(self):
+        url = reverse("fdadb-medications-names")
+        response = self.client.get(url)
+        self.assertEqual(response.data["results"][0]["name"], "DrugName")
+        response = self.client.get(response.data["next"])
+        self.assertEqual([item["name"] for item in response.data["results"]], ["Name 09", "Name 10", "Name 11"])
+
+        # autocomplete results are not paginated with cursors
+        response = self.client.get(url + "?q=name 1")
+        self.assertEqual(response.data["count"], 2)
+
+
+@mock.patch("fdadb.api.FAST_SERIALIZERS", True)
+@mock.patch("fdadb.api.ORJSON_RENDERER", True)
+class FastSerializersAPITests(APITests):
+    def test_same_output(self):
+        strength = MedicationStrength.objects.filter(medication_name="DrugName").first()
+        urls = [
+            reverse("fdadb-medications-names"),
+            reverse("fdadb-medications-names") + "?q=drug",
+            reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"}) + "?q=substance",
+            reverse("fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": strength.pk}),
+        ]
+        for url in urls:
+            invalidate_autocomplete_cache()
+            response = self.client.get(url)
+            self.assertEqual(response["Content-Type"], "application/json")
+            invalidate_autocomplete_cache()
+            with mock.patch("fdadb.api.FAST_SERIALIZERS", False), mock.patch("fdadb.api.ORJSON_RENDERER", False):
+                expected = self.client.get(url)
+            self.assertEqual(response.content, expected.content)
+
+    def test_per_view_option(self):
+        with mock.patch("fdadb.api.MedicationNDCsListAPI.fast_serialization", False):
+            strength = MedicationStrength.objects.filter(medication_name="DrugName").first()
+            url = reverse("fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": strength.pk})
+            with CaptureQueriesContext(connection) as queries:
+                self.client.get(url)
+        # model instances are loaded with the related objects
+        self.assertIn('"fdadb_medicationndc"."fingerprint"', queries[1]["sql"])
+
+
+@mock.patch("fdadb.api.FAST_SERIALIZERS", True)
+class FastSerializersEsAPITests(EsAPITests):
+    pass
+
+
+@mock.patch("fdadb.api.FAST_SERIALIZERS", True)
+class FastSerializersCursorPaginationAPITests(CursorPaginationAPITests):
+    pass
+
+
+class HttpCacheAPITests(BaseTestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        medication_name = MedicationName.objects.create(name="DrugName", active_substances=["Substance"])
+        self.strength = MedicationStrength.objects.create(
+            medication_name=medication_name, strength={"Substance": {"strength": 1, "unit": "mg/l"}}
+        )
+        MedicationNDC.objects.create(medication_strength=self.strength, ndc="0001", manufacturer="M")
+        self.urls = [
+            reverse("fdadb-medications-names"),
+            reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"}),
+            reverse("fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": self.strength.pk}),
+        ]
+
+    def test_conditional_requests(self):
+        for url in self.urls:
+            response = self.client.get(url + "?q=d&page=1")
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Cache-Control"], "public, max-age=0")
+            self.assertEqual(response["Vary"], "Accept")
+            etag, last_modified = response["ETag"], response["Last-Modified"]
+
+            # query params in another order
+            with self.assertNumQueries(0):
+                response = self.client.get(url + "?page=1&q=d", HTTP_IF_NONE_MATCH=etag)
+            self.assertEqual(response.status_code, 304)
+            self.assertEqual(response["Cache-Control"], "public, max-age=0")
+            with self.assertNumQueries(0):
+                response = self.client.get(url + "?page=1&q=d", HTTP_IF_MODIFIED_SINCE=last_modified)
+            self.assertEqual(response.status_code, 304)
+
+            self.assertEqual(self.client.get(url + "?q=dr", HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_new_data_version(self):
+        response = self.client.get(self.urls[2])
+        invalidate_autocomplete_cache()
+        response = self.client.get(self.urls[2], HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("fdadb.api.CACHE_CONTROL_MAX_AGE", 3600)
+    def test_max_age(self):
+        response = self.client.get(self.urls[0])
+        self.assertEqual(response["Cache-Control"], "public, max-age=3600")
+
+    @override_settings(TESTING=False, ELASTICSEARCH_URL="http://localhost:9200")
+    @mock.patch("fdadb.es_search.Elasticsearch")
+    def test_not_modified_without_es_search(self, elasticsearch):
+        self.addCleanup(reset_es_client)
+        reset_es_client()
+        elasticsearch.return_value.search.side_effect = fake_es_search(
+            [{"id": 1, "name": "DrugName", "active_substances": "[]", "strength": "{}"}]
+        )
+        response = self.client.get(self.urls[1] + "?q=mg")
+        self.assertEqual(response.status_code, 200)
+        response = self.client.get(self.urls[1] + "?q=mg", HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(response.status_code, 304)
+        elasticsearch.return_value.search.assert_called_once()
+
+
+class BatchSearchAPITests(BaseTestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        for name in ("DrugName", "OtherDrugName", "Viagra"):
+            medication_name = MedicationName.objects.create(name=name, active_substances=[name + " Substance"])
+            for strength in (1, 2):
+                medication_strength = MedicationStrength.objects.create(
+                    medication_name=medication_name,
+                    strength={name + " Substance": {"strength": strength, "unit": "mg/l"}},
+                )
+                for manufacturer in ("M1", "M2"):
+                    MedicationNDC.objects.create(
+                        medication_strength=medication_strength,
+                        ndc="{}-{}-{}".format(name[:5], strength, manufacturer),
+                        manufacturer=manufacturer,
+                    )
+        self.strength = MedicationStrength.objects.filter(medication_name="Viagra").first()
+        self.url = reverse("fdadb-medications-batch")
+
+    def test_batch_search(self):
+        queries = [
+            {"type": "ndc", "name": "Viagra", "strength_id": self.strength.pk, "q": "m2"},
+            {"type": "name", "q": "drug"},
+            {"type": "strength", "name": "Viagra", "q": "2 mg"},
+            {"type": "name", "q": "via", "size": 1},
+            {"type": "ndc", "name": "Viagra", "strength_id": self.strength.pk},
+        ]
+        # a query for each type of searches
+        with self.assertNumQueries(3):
+            response = self.client.post(self.url, {"queries": queries}, format="json")
+        self.assertEqual(response.status_code, 200)
+        results = response.data["results"]
+        self.assertEqual([item["ndc"] for item in results[0]], ["Viagr-1-M2"])
+        self.assertEqual([item["name"] for item in results[1]], ["DrugName", "OtherDrugName"])
+        self.assertEqual(
+            results[2],
+            [
+                {
+                    "name": "Viagra",
+                    "active_substances": ["Viagra Substance"],
+                    "strength": {"Viagra Substance": {"strength": 2, "unit": "mg/l"}},
+                }
+            ],
+        )
+        self.assertEqual([item["name"] for item in results[3]], ["Viagra"])
+        self.assertEqual([item["ndc"] for item in results[4]], ["Viagr-1-M1", "Viagr-1-M2"])
+
+    @mock.patch("fdadb.api.FAST_SERIALIZERS", True)
+    def test_batch_search_fast_serializers(self):
+        response = self.client.post(self.url, {"queries": [{"type": "strength", "name": "Viagra"}]}, format="json")
+        results = response.data["results"][0]
+        self.assertEqual([item["strength"]["Viagra Substance"]["strength"] for item in results], [1, 2])
+        self.assertEqual(set(results[0]), {"name", "active_substances", "strength"})
+
+    @mock.patch("fdadb.serializers.BATCH_MAX_QUERIES", 2)
+    def test_invalid_queries(self):
+        response = self.client.post(
+            self.url, {"queries": [{"type": "ndc", "name": "Viagra"}, {"type": "drug"}]}, format="json"
+        )
+        self.assertEqual(response.status_code, 400)
+        # errors of the queries by their index
+        errors = response.data["queries"]
+        self.assertEqual(errors[0], {"strength_id": ["This field is required."]})
+        self.assertEqual(errors[1], {"type": ['"drug" is not a valid choice.']})
+
+        response = self.client.post(self.url, {"queries": [{"type": "name"}] * 3}, format="json")
+        self.assertEqual(response.status_code, 400)
+
+    @override_settings(TESTING=False, ELASTICSEARCH_URL="http://localhost:9200")
+    @mock.patch("fdadb.es_search.Elasticsearch")
+    def test_batch_search_es(self, elasticsearch):
+        reset_es_client()
+        self.addCleanup(reset_es_client)
+        elasticsearch.return_value.msearch.return_value = {
+            "responses": [
+                {"hits": {"total": 1, "hits": [{"_source": {"name": "Viagra", "active_substances": "[]"}}]}},
+                {"hits": {"total": 0, "hits": []}},
+            ]
+        }
+        queries = [{"type": "name", "q": "via"}, {"type": "strength", "name": "Viagra", "q": "5"}]
+        with self.assertNumQueries(0):
+            response = self.client.post(self.url, {"queries": queries}, format="json")
+        self.assertEqual(response.data["results"], [[{"name": "Viagra", "active_substances": []}], []])
+        body = elasticsearch.return_value.msearch.call_args[1]["body"]
+        self.assertEqual(body[1]["size"], 10)
+        self.assertEqual(body[2], {"index": "fda_medications_strengths"})
@@ -0,0 +1,191 @@
+import json
+from unittest import mock, skipIf
+
+import django
+from asgiref.sync import sync_to_async
+from django.test import TestCase, override_settings
+from rest_framework.reverse import reverse
+
+from fdadb.cache import invalidate_autocomplete_cache
+from fdadb.es_search import EsSearchAPI, reset_es_client
+from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+from fdadb.pagination import EsLimitOffsetPagination, EsPageNumberPagination
+from tests.test_api import fake_es_search
+
+# the async views use the async ORM and cache APIs added in Django 4.1
+requires_async_orm = skipIf(django.VERSION < (4, 1), "async views require Django>=4.1")
+
+
+@override_settings(ROOT_URLCONF="fdadb.async_api_urls")
+@requires_async_orm
+class AsyncAPITests(TestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        for name in ("DrugName", "OtherDrugName", "NamedDrug"):
+            medication_name = MedicationName.objects.create(name=name, active_substances=[name + " Substance"])
+            for strength in range(12):
+                medication_strength = MedicationStrength.objects.create(
+                    medication_name=medication_name,
+                    strength={name + " Substance": {"strength": strength, "unit": "mg/l"}},
+                )
+                for manufacturer in ("M1", "M2"):
+                    MedicationNDC.objects.create(
+                        medication_strength=medication_strength,
+                        ndc="{}-{}-{}".format(name[:5], strength, manufacturer),
+                        manufacturer=manufacturer,
+                    )
+        self.strength = MedicationStrength.objects.filter(medication_name="DrugName").first()
+        ndcs_url = reverse(
+            "fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": self.strength.pk}
+        )
+        self.urls = [
+            reverse("fdadb-medications-names"),
+            reverse("fdadb-medications-names") + "?q=drug&limit=2&offset=1",
+            reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"}) + "?page=2",
+            reverse("fdadb-medications-strengths", kwargs={"medication_name": "DrugName"}) + "?q=substance&page=last",
+            ndcs_url + "?q=m1",
+        ]
+
+    @sync_to_async
+    def get_sync_responses(self):
+        responses = []
+        with override_settings(ROOT_URLCONF="fdadb.api_urls"):
+            for url in self.urls:
+                invalidate_autocomplete_cache()
+                responses.append(self.client.get(url))
+        invalidate_autocomplete_cache()
+        return responses
+
+    async def test_same_responses_as_sync_views(self):
+        for url, expected in zip(self.urls, await self.get_sync_responses()):
+            response = await self.async_client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response["Content-Type"], "application/json")
+            self.assertEqual(json.loads(response.content), json.loads(expected.content))
+            self.assertTrue(response["ETag"])
+            self.assertTrue(response["Last-Modified"])
+            self.assertEqual(response["Cache-Control"], "public, max-age=0")
+
+    @mock.patch("fdadb.api.FAST_SERIALIZERS", True)
+    async def test_fast_serializers(self):
+        await self.test_same_responses_as_sync_views()
+
+    @mock.patch.object(EsPageNumberPagination, "page_size", None)
+    @mock.patch.object(EsLimitOffsetPagination, "default_limit", None)
+    async def test_not_paginated(self):
+        self.urls.append(reverse("fdadb-medications-names") + "?q=dru")
+        await self.test_same_responses_as_sync_views()
+
+    @mock.patch("fdadb.api.NAME_SEARCH_BACKEND", "memory")
+    async def test_memory_name_search(self):
+        response = await self.async_client.get(reverse("fdadb-medications-names") + "?q=named")
+        self.assertEqual([item["name"] for item in json.loads(response.content)["results"]], ["NamedDrug"])
+
+    async def test_not_modified(self):
+        response = await self.async_client.get(self.urls[2])
+        response = await self.async_client.get(self.urls[2], headers={"If-None-Match": response["ETag"]})
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response["Cache-Control"], "public, max-age=0")
+
+    async def test_invalid_page(self):
+        response = await self.async_client.get(self.urls[2].replace("page=2", "page=5"))
+        self.assertEqual(response.status_code, 404)
+        self.assertEqual(json.loads(response.content), {"detail": "Invalid page."})
+
+
+@override_settings(ROOT_URLCONF="fdadb.async_api_urls", TESTING=False, ELASTICSEARCH_URL="http://localhost:9200")
+@requires_async_orm
+class AsyncEsAPITests(TestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        reset_es_client()
+        self.addCleanup(reset_es_client)
+        patcher = mock.patch("fdadb.es_search.AsyncElasticsearch")
+        self.es = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        self.es.search = mock.AsyncMock()
+
+    async def test_names_api(self):
+        self.es.search.side_effect = fake_es_search(
+            [{"name": "Drug {}".format(i), "active_substances": ["Substance"]} for i in range(25)]
+        )
+        response = await self.async_client.get(reverse("fdadb-medications-names") + "?q=drug&limit=5&offset=20")
+        data = json.loads(response.content)
+        self.assertEqual(data["count"], 25)
+        self.assertEqual([item["name"] for item in data["results"]], ["Drug {}".format(i) for i in range(20, 25)])
+        self.es.search.assert_awaited_once_with(
+            index="fda_medications_names", body=EsSearchAPI.get_name_search_body("drug", 5, 20)
+        )
+
+        # cached autocomplete results
+        await self.async_client.get(reverse("fdadb-medications-names") + "?q=DRUG&limit=5&offset=20")
+        self.es.search.assert_awaited_once()
+
+    @mock.patch.object(EsLimitOffsetPagination, "default_limit", None)
+    async def test_names_api_not_paginated(self):
+        self.es.search.side_effect = fake_es_search(
+            [{"name": "Drug {}".format(i), "active_substances": ["Substance"]} for i in range(25)]
+        )
+        with mock.patch("fdadb.api.AUTOCOMPLETE_LIMIT", 20):
+            response = await self.async_client.get(reverse("fdadb-medications-names") + "?q=drug")
+        self.assertEqual(len(json.loads(response.content)), 20)
+
+        with mock.patch("fdadb.api.ES_MAX_RESULT_WINDOW", 15):
+            response = await self.async_client.get(reverse("fdadb-medications-names"))
+        self.assertEqual(len(json.loads(response.content)), 15)
+
+    async def test_max_result_window(self):
+        url = reverse("fdadb-medications-strengths", kwargs={"medication_name": "NamedDrug"})
+        response = await self.async_client.get(url + "?page=1001")
+        self.assertEqual(response.status_code, 404)
+        self.es.search.assert_not_awaited()
+
+    async def test_strengths_api(self):
+        self.es.search.side_effect = fake_es_search(
+            [
+                {
+                    "id": i,
+                    "name": "NamedDrug",
+                    "active_substances": json.dumps(["Substance"]),
+                    "strength": json.dumps({"Substance": {"strength": str(i), "unit": "mg/l"}}),
+                }
+                for i in range(15)
+            ]
+        )
+        url = reverse("fdadb-medications-strengths", kwargs={"medication_name": "NamedDrug"})
+        response = await self.async_client.get(url + "?q=mg&page=last")
+        data = json.loads(response.content)
+        self.assertEqual(data["count"], 15)
+        self.assertEqual(data["results"][0]["strength"], {"Substance": {"strength": "10", "unit": "mg/l"}})
+        self.assertIsNone(data["next"])
+        # the count is known after the first search
+        self.assertEqual(
+            [call[1]["body"] for call in self.es.search.await_args_list],
+            [
+                EsSearchAPI.get_strength_search_body("NamedDrug", "mg", 10, 0),
+                EsSearchAPI.get_strength_search_body("NamedDrug", "mg", 5, 10),
+            ],
+        )
+
+    async def test_ndcs_api(self):
+        self.es.search.side_effect = fake_es_search(
+            [
+                {
+                    "id": i,
+                    "name": "OtherDrugName",
+                    "active_substances": json.dumps(["Substance"]),
+                    "strength": json.dumps({"Substance": {"strength": "1", "unit": "mg/l"}}),
+                    "strength_id": 7,
+                    "ndc": "0001-{}".format(i),
+                    "manufacturer": "M{}".format(i),
+                }
+                for i in range(3)
+            ]
+        )
+        url = reverse("fdadb-medications-ndcs", kwargs={"medication_name": "OtherDrugName", "strength_id": 7})
+        response = await self.async_client.get(url)
+        data = json.loads(response.content)
+        self.assertEqual([item["ndc"] for item in data["results"]], ["0001-0", "0001-1", "0001-2"])
+        self.es.search.assert_awaited_once_with(
+            index="fda_medications_ndcs", body=EsSearchAPI.get_ndc_search_body("OtherDrugName", "7", None, 10, 0)
+        )
@@ -0,0 +1,194 @@
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
+
+from django.test import TestCase, override_settings
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from fdadb.cache import (DATA_VERSION_CACHE_KEY, AutocompleteCache, LRUCache, ResponseCache, autocomplete_cache,
+                         get_cache_backend, get_data_version_info, invalidate_autocomplete_cache)
+from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+
+
+class LRUCacheTestCase(TestCase):
+    def test_eviction(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        cache.set("a", 1)
+        cache.set("b", 2)
+        self.assertEqual(cache.get("a"), 1)
+        cache.set("c", 3)
+        self.assertEqual(cache.get("b"), None)
+        self.assertEqual(cache.get("a"), 1)
+        self.assertEqual(cache.get("c"), 3)
+        self.assertEqual(len(cache), 2)
+
+    def test_expiration(self):
+        cache = LRUCache(max_size=2, ttl=60)
+        with mock.patch("fdadb.cache.time.monotonic", return_value=100):
+            cache.set("a", 1)
+        with mock.patch("fdadb.cache.time.monotonic", return_value=159):
+            self.assertEqual(cache.get("a"), 1)
+        with mock.patch("fdadb.cache.time.monotonic", return_value=161):
+            self.assertEqual(cache.get("a"), None)
+        self.assertEqual(len(cache), 0)
+
+
+class AutocompleteCacheTestCase(TestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+
+    def test_get_or_set(self):
+        cache = AutocompleteCache(max_size=10, ttl=60)
+        compute = mock.Mock(return_value=["result"])
+        self.assertEqual(cache.get_or_set("db", "Ami", 10, compute), ["result"])
+        self.assertEqual(cache.get_or_set("db", " ami ", 10, compute), ["result"])
+        self.assertEqual(compute.call_count, 1)
+
+        cache.get_or_set("db", "ami", 5, compute)
+        cache.get_or_set("es", "ami", 10, compute)
+        self.assertEqual(compute.call_count, 3)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 3, "size": 3})
+
+        invalidate_autocomplete_cache()
+        cache.get_or_set("db", "ami", 10, compute)
+        self.assertEqual(compute.call_count, 4)
+
+    def test_disabled(self):
+        cache = AutocompleteCache(max_size=0, ttl=60)
+        compute = mock.Mock(return_value=["result"])
+        cache.get_or_set("db", "ami", 10, compute)
+        cache.get_or_set("db", "ami", 10, compute)
+        self.assertEqual(compute.call_count, 2)
+
+    @override_settings(
+        CACHES={
+            "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+            "autocomplete": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "autocomplete"},
+        }
+    )
+    def test_django_cache_backend(self):
+        cache = AutocompleteCache(max_size=10, ttl=60, backend="autocomplete")
+        compute = mock.Mock(return_value=["result"])
+        cache.get_or_set("db", "ami", 10, compute)
+        cache.get_or_set("db", "ami", 10, compute)
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(cache.stats(), {"hits": 1, "misses": 1, "size": 0})
+
+
+class DataVersionTestCase(TestCase):
+    def test_persisted(self):
+        invalidate_autocomplete_cache()
+        version, updated = get_data_version_info()
+        with self.assertNumQueries(0):
+            self.assertEqual(get_data_version_info(), (version, updated))
+
+        # the version is loaded again from the database when the cache lost it (or it expired)
+        get_cache_backend().delete(DATA_VERSION_CACHE_KEY)
+        with self.assertNumQueries(1):
+            self.assertEqual(get_data_version_info(), (version, updated))
+
+        invalidate_autocomplete_cache()
+        new_version, new_updated = get_data_version_info()
+        self.assertNotEqual(new_version, version)
+        self.assertGreaterEqual(new_updated, updated)
+
+
+class AutocompleteAPICacheTestCase(APITestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        MedicationName.objects.create(name="Amitriptyline", active_substances=["Amitriptyline"])
+
+    def test_names_api_cached(self):
+        url = reverse("fdadb-medications-names")
+        response = self.client.get(url + "?q=ami")
+        self.assertEqual([item["name"] for item in response.data["results"]], ["Amitriptyline"])
+
+        MedicationName.objects.create(name="Amiodarone", active_substances=["Amiodarone"])
+        hits = autocomplete_cache.hits
+        with self.assertNumQueries(0):
+            response = self.client.get(url + "?q=AMI")
+        self.assertEqual([item["name"] for item in response.data["results"]], ["Amitriptyline"])
+        self.assertEqual(autocomplete_cache.hits, hits + 1)
+
+        invalidate_autocomplete_cache()
+        response = self.client.get(url + "?q=ami")
+        self.assertEqual([item["name"] for item in response.data["results"]], ["Amiodarone", "Amitriptyline"])
+
+
+class ResponseCacheTestCase(TestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+
+    def test_get_or_set(self):
+        cache = ResponseCache(backend="default", ttl=60)
+        compute = mock.Mock(return_value={"results": []})
+        self.assertEqual(cache.get_or_set("/ndcs", "q=a", compute), {"results": []})
+        self.assertEqual(cache.get_or_set("/ndcs", "q=a", compute), {"results": []})
+        cache.get_or_set("/ndcs", "q=b", compute)
+        self.assertEqual(compute.call_count, 2)
+
+        invalidate_autocomplete_cache()
+        cache.get_or_set("/ndcs", "q=a", compute)
+        self.assertEqual(compute.call_count, 3)
+        stats = cache.stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["hit_ratio"]), (1, 3, 0.25))
+
+    def test_disabled(self):
+        cache = ResponseCache(backend=None)
+        compute = mock.Mock(return_value={"results": []})
+        cache.get_or_set("/ndcs", "", compute)
+        cache.get_or_set("/ndcs", "", compute)
+        self.assertEqual(compute.call_count, 2)
+
+    def test_single_flight(self):
+        cache = ResponseCache(backend="default", ttl=60)
+        cache.poll_interval = 0.01
+
+        def compute():
+            time.sleep(0.1)
+            return {"results": []}
+
+        compute = mock.Mock(side_effect=compute)
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            results = list(executor.map(lambda i: cache.get_or_set("/ndcs", "", compute), range(8)))
+        self.assertEqual(results, [{"results": []}] * 8)
+        self.assertEqual(compute.call_count, 1)
+        self.assertEqual(cache.stats()["hits"], 7)
+        self.assertGreaterEqual(cache.stats()["average_recompute_seconds"], 0.1)
+
+    def test_lock_timeout(self):
+        cache = ResponseCache(backend="default", ttl=60, lock_timeout=0.1)
+        cache.poll_interval = 0.01
+        # a request computing the response never finished
+        get_cache_backend().add(cache.make_key("/ndcs", "") + ":lock", True)
+        self.assertEqual(cache.get_or_set("/ndcs", "", lambda: {"results": []}), {"results": []})
+
+
+class ResponseCacheAPITestCase(APITestCase):
+    def setUp(self):
+        invalidate_autocomplete_cache()
+        medication_name = MedicationName.objects.create(name="DrugName", active_substances=["Substance"])
+        self.strength = MedicationStrength.objects.create(
+            medication_name=medication_name, strength={"Substance": {"strength": 1, "unit": "mg/l"}}
+        )
+        MedicationNDC.objects.create(medication_strength=self.strength, ndc="0001", manufacturer="M")
+        patcher = mock.patch("fdadb.api.response_cache", ResponseCache(backend="default", ttl=60))
+        self.response_cache = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_ndcs_api_cached(self):
+        url = reverse("fdadb-medications-ndcs", kwargs={"medication_name": "DrugName", "strength_id": self.strength.pk})
+        response = self.client.get(url + "?q=m&page=1")
+        self.assertEqual([item["ndc"] for item in response.data["results"]], ["0001"])
+
+        MedicationNDC.objects.create(medication_strength=self.strength, ndc="0002", manufacturer="M")
+        with self.assertNumQueries(0):
+            response = self.client.get(url + "?page=1&q=m")
+        self.assertEqual([item["ndc"] for item in response.data["results"]], ["0001"])
+        self.assertEqual(self.response_cache.stats()["hits"], 1)
+
+        # invalidated by imports and indexing
+        invalidate_autocomplete_cache()
+        response = self.client.get(url + "?q=m&page=1")
+        self.assertEqual([item["ndc"] for item in response.data["results"]], ["0001", "0002"])
@@ -0,0 +1,72 @@
+import importlib
+import sys
+from unittest import mock
+
+from django.test import TestCase
+
+from fdadb import db_search
+from fdadb.db_search import get_search_filter, search_many, search_queryset
+from fdadb.models import MedicationName
+
+
+class DbSearchTestCase(TestCase):
+    def setUp(self):
+        for name in ("Amitriptyline", "Ami-Lac", "Viagra"):
+            MedicationName.objects.create(name=name, active_substances=[])
+
+    def test_search_queryset(self):
+        queryset = search_queryset(MedicationName.objects.all(), "name", "AMI")
+        self.assertEqual([o.name for o in queryset], ["Ami-Lac", "Amitriptyline"])
+        self.assertNotIn("similarity", queryset.query.annotations)
+
+    def test_search_queryset_postgresql(self):
+        with mock.patch("fdadb.db_search.connections", {"default": mock.Mock(vendor="postgresql")}):
+            queryset = search_queryset(MedicationName.objects.all(), "name", "ami")
+        self.assertIn("similarity", queryset.query.annotations)
+        self.assertEqual(queryset.query.order_by, ("-similarity", "pk"))
+
+    def test_search_queryset_without_postgres_support(self):
+        # django.contrib.postgres cannot be imported without psycopg2 on Django<4.2
+        with mock.patch.dict(sys.modules, {"django.contrib.postgres.search": None}):
+            importlib.reload(db_search)
+            queryset = db_search.search_queryset(MedicationName.objects.all(), "name", "AMI")
+        importlib.reload(db_search)
+        self.assertEqual([o.name for o in queryset], ["Ami-Lac", "Amitriptyline"])
+
+    @mock.patch("fdadb.db_search.TRIGRAM_SEARCH", False)
+    def test_search_queryset_postgresql_disabled(self):
+        with mock.patch("fdadb.db_search.connections", {"default": mock.Mock(vendor="postgresql")}):
+            queryset = search_queryset(MedicationName.objects.all(), "name", "ami")
+        self.assertNotIn("similarity", queryset.query.annotations)
+
+
+class SearchManyTestCase(TestCase):
+    def setUp(self):
+        for name in ("Amitriptyline", "Ami-Lac", "Amiodarone", "Viagra", "Lamisil"):
+            MedicationName.objects.create(name=name, active_substances=[])
+
+    def test_search_many(self):
+        searches = [
+            (get_search_filter("name", "ami"), 2),
+            (get_search_filter("name", "gra"), 10),
+            (get_search_filter("name", "nothing"), 10),
+            (get_search_filter("name", "ami"), 10),
+            (get_search_filter("name", ""), 1),
+        ]
+        with self.assertNumQueries(1):
+            results = search_many(MedicationName.objects.all(), searches, ("name",))
+        self.assertEqual(
+            [[o.name for o in rows] for rows in results],
+            [
+                ["Ami-Lac", "Amiodarone"],
+                ["Viagra"],
+                [],
+                ["Ami-Lac", "Amiodarone", "Amitriptyline", "Lamisil"],
+                ["Ami-Lac"],
+            ],
+        )
+
+    def test_search_many_values(self):
+        results = search_many(MedicationName.objects.values("name"), [(get_search_filter("name", "vi"), 10)])
+        self.assertEqual([[row["name"] for row in rows] for rows in results], [["Viagra"]])
+        self.assertEqual(search_many(MedicationName.objects.all(), []), [])
@@ -0,0 +1,272 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+from io import StringIO
+from unittest import mock
+
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from elasticsearch import Elasticsearch
+from freezegun import freeze_time
+
+from fdadb.es_search import EsSearchAPI, get_es_client, reset_es_client
+from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+
+
+def fake_bulk(actions_list):
+    def bulk(client, actions, **kwargs):
+        for action in actions:
+            actions_list.append(action)
+            yield not action["_index"].startswith("fda_medications_ndcs") or action["_id"] % 2, {}
+
+    return bulk
+
+
+@override_settings(ELASTICSEARCH_URL="http://localhost:9200")
+@freeze_time("2020-01-01")
+class EsSearchAPITestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch("fdadb.es_search.Elasticsearch")
+        self.es = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        reset_es_client()
+        self.addCleanup(reset_es_client)
+        self.es.indices.exists.return_value = False
+        self.es.indices.exists_alias.return_value = False
+        self.es.indices.get.return_value = {}
+
+        medication_name = MedicationName.objects.create(name="DrugName", active_substances=["Substance"])
+        self.strength = MedicationStrength.objects.create(
+            medication_name=medication_name, strength={"Substance": {"strength": "10", "unit": "mg/1"}}
+        )
+        self.ndcs = [
+            MedicationNDC.objects.create(medication_strength=self.strength, ndc=ndc, manufacturer="Labeler")
+            for ndc in ("0001-0", "0001-1")
+        ]
+
+    def test_index_medications(self):
+        actions = []
+        with mock.patch("fdadb.es_search.helpers.streaming_bulk", side_effect=fake_bulk(actions)) as streaming_bulk:
+            stats = EsSearchAPI().index_medications(chunk_size=2)
+
+        self.assertEqual(streaming_bulk.call_count, 3)
+        self.assertEqual(streaming_bulk.call_args[1]["chunk_size"], 2)
+        self.assertEqual(
+            actions,
+            [
+                {
+                    "_index": "fda_medications_names_20200101000000000000",
+                    "_type": "medication_name",
+                    "_id": "DrugName",
+                    "_source": {"name": "DrugName", "active_substances": ["Substance"]},
+                },
+                {
+                    "_index": "fda_medications_strengths_20200101000000000000",
+                    "_type": "medication_strength",
+                    "_id": self.strength.id,
+                    "_source": {
+                        "id": self.strength.id,
+                        "name": "DrugName",
+                        "active_substances": json.dumps(["Substance"]),
+                        "strength": json.dumps({"Substance": {"strength": "10", "unit": "mg/1"}}),
+                        "strength_search_string": "Substance 10 mg/1",
+                    },
+                },
+                *[
+                    {
+                        "_index": "fda_medications_ndcs_20200101000000000000",
+                        "_type": "medication_ndc",
+                        "_id": ndc.id,
+                        "_source": {
+                            "id": ndc.id,
+                            "name": "DrugName",
+                            "active_substances": json.dumps(["Substance"]),
+                            "strength": json.dumps({"Substance": {"strength": "10", "unit": "mg/1"}}),
+                            "strength_id": self.strength.id,
+                            "ndc": ndc.ndc,
+                            "manufacturer": "Labeler",
+                        },
+                    }
+                    for ndc in self.ndcs
+                ],
+            ],
+        )
+        self.assertEqual(
+            [(index, index_stats["indexed"], index_stats["failed"]) for index, index_stats in stats.items()],
+            [("fda_medications_names", 1, 0), ("fda_medications_strengths", 1, 0), ("fda_medications_ndcs", 1, 1)],
+        )
+
+    def test_index_medications_streams_rows(self):
+        actions = []
+        with mock.patch("fdadb.es_search.helpers.streaming_bulk", side_effect=fake_bulk(actions)):
+            # a single query for each index, no model instances or related objects are loaded
+            with self.assertNumQueries(3):
+                EsSearchAPI().index_medications()
+        self.assertEqual(len(actions), 4)
+
+    def test_index_medications_parallel(self):
+        actions = []
+        with mock.patch("fdadb.es_search.helpers.parallel_bulk", side_effect=fake_bulk(actions)) as parallel_bulk:
+            EsSearchAPI().index_medications(thread_count=4)
+
+        self.assertEqual(parallel_bulk.call_count, 3)
+        self.assertEqual(parallel_bulk.call_args[1]["thread_count"], 4)
+        self.assertEqual(len(actions), 4)
+
+    def test_index_command(self):
+        out = StringIO()
+        with mock.patch("fdadb.es_search.helpers.streaming_bulk", side_effect=fake_bulk([])):
+            call_command("fdadb_es_index", chunk_size=100, stdout=out)
+
+        output = out.getvalue()
+        self.assertIn("fda_medications_names: 1 documents indexed, 0 failed", output)
+        self.assertIn("fda_medications_ndcs: 1 documents indexed, 1 failed", output)
+
+    def test_index_medications_swaps_aliases(self):
+        self.es.indices.exists.side_effect = lambda index: index in ("fda_medications_names", "fda_medications_ndcs")
+        self.es.indices.exists_alias.side_effect = lambda name: name == "fda_medications_names"
+        self.es.indices.get_alias.return_value = {"fda_medications_names_20190101000000000000": {}}
+        self.es.indices.get.side_effect = lambda index, **kwargs: {
+            index.replace("*", "20190101000000000000"): {},
+            index.replace("*", "20200101000000000000"): {},
+        }
+
+        with mock.patch("fdadb.es_search.helpers.streaming_bulk", side_effect=fake_bulk([])):
+            EsSearchAPI().index_medications()
+
+        for index in (
+            "fda_medications_names_20200101000000000000",
+            "fda_medications_strengths_20200101000000000000",
+            "fda_medications_ndcs_20200101000000000000",
+        ):
+            self.es.indices.create.assert_any_call(index=index, body=mock.ANY)
+            self.es.indices.put_settings.assert_any_call(
+                index=index, body={"index": {"refresh_interval": "1s", "number_of_replicas": 1}}
+            )
+        self.assertEqual(self.es.indices.create.call_args[1]["body"]["settings"]["refresh_interval"], "-1")
+        self.assertEqual(self.es.indices.create.call_args[1]["body"]["settings"]["number_of_replicas"], 0)
+
+        self.es.indices.update_aliases.assert_called_once_with(
+            body={
+                "actions": [
+                    {
+                        "remove": {
+                            "index": "fda_medications_names_20190101000000000000",
+                            "alias": "fda_medications_names",
+                        }
+                    },
+                    {"add": {"index": "fda_medications_names_20200101000000000000", "alias": "fda_medications_names"}},
+                    {
+                        "add": {
+                            "index": "fda_medications_strengths_20200101000000000000",
+                            "alias": "fda_medications_strengths",
+                        }
+                    },
+                    {"remove_index": {"index": "fda_medications_ndcs"}},
+                    {"add": {"index": "fda_medications_ndcs_20200101000000000000", "alias": "fda_medications_ndcs"}},
+                ]
+            }
+        )
+        self.assertEqual(
+            [call[1]["index"] for call in self.es.indices.delete.call_args_list],
+            [
+                "fda_medications_names_20190101000000000000",
+                "fda_medications_strengths_20190101000000000000",
+                "fda_medications_ndcs_20190101000000000000",
+            ],
+        )
+
+    def test_index_medications_failed(self):
+        with mock.patch("fdadb.es_search.helpers.streaming_bulk", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                EsSearchAPI().index_medications()
+
+        self.es.indices.update_aliases.assert_not_called()
+        self.es.indices.delete.assert_called_once_with(
+            index="fda_medications_names_20200101000000000000,fda_medications_strengths_20200101000000000000,"
+            "fda_medications_ndcs_20200101000000000000",
+            ignore=[404],
+        )
+
+
+@override_settings(ELASTICSEARCH_URL="http://localhost:9200")
+class EsSearchManyTestCase(TestCase):
+    def setUp(self):
+        patcher = mock.patch("fdadb.es_search.Elasticsearch")
+        self.es = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+        reset_es_client()
+        self.addCleanup(reset_es_client)
+
+    def test_search_many(self):
+        self.es.msearch.return_value = {
+            "responses": [
+                {"hits": {"total": {"value": 1}, "hits": [{"_source": {"name": "Viagra", "active_substances": "[]"}}]}},
+                {"hits": {"total": 0, "hits": []}},
+                {"hits": {"total": {"value": 1}, "hits": [{"_source": {"ndc": "0001", "strength": "{}"}}]}},
+            ]
+        }
+        queries = [
+            {"type": "name", "q": "via", "size": 5},
+            {"type": "strength", "name": "Viagra", "q": "mg", "size": 10},
+            {"type": "ndc", "name": "Viagra", "strength_id": 1, "q": None, "size": 10},
+        ]
+        self.assertEqual(
+            EsSearchAPI().search_many(queries),
+            [[{"name": "Viagra", "active_substances": []}], [], [{"ndc": "0001", "strength": {}}]],
+        )
+        self.es.msearch.assert_called_once_with(
+            body=[
+                {"index": "fda_medications_names"},
+                EsSearchAPI.get_name_search_body("via", 5, 0),
+                {"index": "fda_medications_strengths"},
+                EsSearchAPI.get_strength_search_body("Viagra", "mg", 10, 0),
+                {"index": "fda_medications_ndcs"},
+                EsSearchAPI.get_ndc_search_body("Viagra", 1, None, 10, 0),
+            ]
+        )
+
+    def test_search_many_error(self):
+        self.es.msearch.return_value = {"responses": [{"error": {"type": "index_not_found_exception"}}]}
+        with self.assertRaises(Exception):
+            EsSearchAPI().search_many([{"type": "name", "q": "via"}])
+        self.assertEqual(EsSearchAPI().search_many([]), [])
+        self.es.msearch.assert_called_once()
+
+
+@override_settings(ELASTICSEARCH_URL="http://localhost:9200")
+class EsClientTestCase(TestCase):
+    def setUp(self):
+        reset_es_client()
+        self.addCleanup(reset_es_client)
+
+    @mock.patch("fdadb.es_search.Elasticsearch")
+    def test_shared_client(self, elasticsearch):
+        elasticsearch.side_effect = lambda *args, **kwargs: mock.Mock()
+        client = get_es_client()
+        self.assertIs(EsSearchAPI().es, client)
+        self.assertIs(EsSearchAPI().es, client)
+        elasticsearch.assert_called_once_with(["http://localhost:9200"])
+
+        with override_settings(ELASTICSEARCH_URL="http://other:9200"):
+            self.assertIsNot(get_es_client(), client)
+
+        # forked process
+        with mock.patch("fdadb.es_search.os.getpid", return_value=-1):
+            forked_client = get_es_client()
+        self.assertIsNot(forked_client, client)
+
+    def test_client_options(self):
+        # a real client, the default options are accepted by any version of elasticsearch-py
+        self.assertIsInstance(get_es_client(), Elasticsearch)
+
+        with mock.patch("fdadb.es_search.ES_CLIENT_OPTIONS", {"max_retries": 5}):
+            reset_es_client()
+            self.assertIsInstance(get_es_client(), Elasticsearch)
+
+    @mock.patch("fdadb.es_search.Elasticsearch")
+    def test_shared_client_threads(self, elasticsearch):
+        elasticsearch.side_effect = lambda *args, **kwargs: mock.Mock()
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            clients = list(executor.map(lambda i: get_es_client(), range(32)))
+        self.assertEqual(len({id(client) for client in clients}), 1)
+        elasticsearch.assert_called_once()
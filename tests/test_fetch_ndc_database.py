@@ -1,13 +1,22 @@
 import io
 import os.path
+import re
+import tempfile
 import zipfile
+from collections import OrderedDict
 from unittest import mock
 
-from django.core.management import call_command
-from django.test import TestCase
+import requests_mock
+from django.core.management import CommandError, call_command
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Max
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.utils import timezone
 
 from fdadb.management.commands import fetch_ndc_database
-from fdadb.models import MedicationName, MedicationNDC, MedicationStrength
+from fdadb.models import (ImportCheckpoint, MedicationName, MedicationNDC, MedicationStrength,
+                          MedicationStrengthIngredient)
+from fdadb.ndc_parser import get_strength_hash, parse_products
 
 THIS_FILE_DIR = os.path.dirname(os.path.realpath(__file__))
 TEST_PRODUCT_FILE = os.path.join(THIS_FILE_DIR, "test_data", "product.txt")
@@ -21,20 +30,23 @@ def as_zip_file(names_and_contents):
     return zip_buffer.getvalue()
 
 
-def fake_database_file():
+def fake_database_file(replace=()):
     with open(TEST_PRODUCT_FILE, "rb") as f:
-        return as_zip_file([("product.txt", f.read())])
+        data = f.read()
+    for old, new in replace:
+        data = data.replace(old, new)
+    return io.BytesIO(as_zip_file([("product.txt", data)]))
 
 
-class FetchNdcDatabaseTestCase(TestCase):
-    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
-    def test_command(self, fetch_database_file):
-        fetch_database_file.return_value = fake_database_file()
+def fake_fetch_database_file(replace=()):
+    def fetch_database_file(*args, **kwargs):
+        return fake_database_file(replace)
 
-        for model in (MedicationName, MedicationNDC, MedicationStrength):
-            self.assertEqual(model.objects.count(), 0)
+    return fetch_database_file
 
-        call_command("fetch_ndc_database")
+
+class ImportedProductsMixin(object):
+    def assert_imported_products(self):
         meds = {o.name: o for o in MedicationName.objects.all()}
         self.assertEqual(sorted(meds.keys()), ["Drug A Suffix A", "Drug B Suffix B"])
 
@@ -50,8 +62,11 @@ class FetchNdcDatabaseTestCase(TestCase):
                 (medication_ndc.ndc, medication_ndc.manufacturer),
             )
 
+        for medication_strength in MedicationStrength.objects.all():
+            self.assertEqual(medication_strength.strength_hash, get_strength_hash(medication_strength.strength))
+
         self.assertEqual(
-            [strength_and_ndc_entries(o) for o in MedicationNDC.objects.order_by("pk")],
+            [strength_and_ndc_entries(o) for o in MedicationNDC.objects.order_by("ndc")],
             [
                 (
                     med_a,
@@ -81,3 +96,392 @@ class FetchNdcDatabaseTestCase(TestCase):
                 ),
             ],
         )
+
+
+class FetchNdcDatabaseTestCase(ImportedProductsMixin, TestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.object(fetch_ndc_database, "FDADB_CACHE_DIR", cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+
+        for model in (MedicationName, MedicationNDC, MedicationStrength):
+            self.assertEqual(model.objects.count(), 0)
+
+        call_command("fetch_ndc_database")
+        self.assert_imported_products()
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_strength_search(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+        call_command("fetch_ndc_database")
+
+        self.assertEqual(
+            sorted(MedicationStrength.objects.values_list("strength_search", flat=True)),
+            [
+                "Substance A 10 mg/1",
+                "Substance A 40 mg/1",
+                "Substance B-1 10 mg/1, Substance B-2 11 mg/mL",
+                "Substance B-1 20 mg/1, Substance B-2 21 mg/mL",
+            ],
+        )
+        strength = MedicationStrength.objects.get(strength_search__startswith="Substance B-1 20")
+        self.assertEqual(
+            sorted(strength.ingredients.values_list("substance", "strength", "unit")),
+            [("Substance B-1", "20", "mg/1"), ("Substance B-2", "21", "mg/mL")],
+        )
+        self.assertEqual(MedicationStrengthIngredient.objects.count(), 6)
+
+    def test_command_download(self):
+        with requests_mock.Mocker() as m:
+            m.get(fetch_ndc_database.FDA_NDC_DATABASE_URL, content=fake_database_file().getvalue())
+            call_command("fetch_ndc_database")
+        self.assert_imported_products()
+
+    def test_command_download_not_modified(self):
+        url = fetch_ndc_database.FDA_NDC_DATABASE_URL
+        content = fake_database_file().getvalue()
+        with requests_mock.Mocker() as m:
+            m.get(url, content=content, headers={"ETag": '"v1"', "Last-Modified": "Wed, 01 Jan 2020 00:00:00 GMT"})
+            call_command("fetch_ndc_database")
+            self.assertNotIn("If-None-Match", m.last_request.headers)
+            MedicationNDC.objects.all().delete()
+
+            # the server responds with 304 Not Modified
+            m.get(url, status_code=304)
+            call_command("fetch_ndc_database")
+            self.assertEqual(m.last_request.headers["If-None-Match"], '"v1"')
+            self.assertEqual(m.last_request.headers["If-Modified-Since"], "Wed, 01 Jan 2020 00:00:00 GMT")
+            self.assertEqual(MedicationNDC.objects.count(), 0)
+
+            # the server ignores the validators, but the archive is the same
+            m.get(url, content=content, headers={"ETag": '"v2"'})
+            call_command("fetch_ndc_database")
+            self.assertEqual(MedicationNDC.objects.count(), 0)
+
+            m.get(url, content=content)
+            call_command("fetch_ndc_database", force=True)
+            self.assertNotIn("If-None-Match", m.last_request.headers)
+        self.assert_imported_products()
+
+    def test_command_download_failed_import(self):
+        url = fetch_ndc_database.FDA_NDC_DATABASE_URL
+        with requests_mock.Mocker() as m:
+            m.get(url, content=fake_database_file().getvalue(), headers={"ETag": '"v1"'})
+            with mock.patch.object(fetch_ndc_database.Command, "save_products", side_effect=ValueError):
+                with self.assertRaises(ValueError):
+                    call_command("fetch_ndc_database")
+
+            call_command("fetch_ndc_database")
+            self.assertNotIn("If-None-Match", m.last_request.headers)
+        self.assert_imported_products()
+
+    def test_command_download_interrupted(self):
+        with requests_mock.Mocker() as m:
+            m.get(fetch_ndc_database.FDA_NDC_DATABASE_URL, content=fake_database_file().getvalue())
+            with mock.patch("requests.models.Response.iter_content", side_effect=ConnectionResetError):
+                with self.assertRaises(ConnectionResetError):
+                    call_command("fetch_ndc_database")
+        # the partial download is removed
+        self.assertEqual(os.listdir(fetch_ndc_database.FDADB_CACHE_DIR), [])
+
+    def test_command_local_file(self):
+        with tempfile.NamedTemporaryFile(suffix=".zip") as f:
+            f.write(fake_database_file().getvalue())
+            f.flush()
+            with requests_mock.Mocker():
+                call_command("fetch_ndc_database", file=f.name)
+        self.assert_imported_products()
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_small_batches(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+
+        call_command("fetch_ndc_database", batch_size=1)
+        self.assert_imported_products()
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_workers(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+
+        out = io.StringIO()
+        with mock.patch("sys.stdout", out):
+            call_command("fetch_ndc_database", batch_size=2, workers=2)
+        self.assert_imported_products()
+        for stage in ("reader", "parser", "writer", "peak memory"):
+            self.assertIn("\n{}: ".format(stage), out.getvalue())
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_workers_failed_read(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+
+        with mock.patch.object(fetch_ndc_database.Command, "get_products_data", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                call_command("fetch_ndc_database", workers=2)
+        self.assertEqual(MedicationNDC.objects.count(), 0)
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_resume(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+        save_products = fetch_ndc_database.Command.save_products
+        saved_batches = []
+
+        def save_batches(limit):
+            def save(command, products, *args, **kwargs):
+                if len(saved_batches) == limit:
+                    raise ValueError
+                saved_batches.append([product.ndc for product in products])
+                return save_products(command, products, *args, **kwargs)
+
+            return save
+
+        with mock.patch.object(fetch_ndc_database.Command, "save_products", save_batches(1)):
+            with self.assertRaises(ValueError):
+                call_command("fetch_ndc_database", batch_size=2)
+        self.assertEqual(saved_batches, [["0001-0", "0001-1"]])
+        self.assertEqual(ImportCheckpoint.objects.get().rows, 2)
+        self.assertEqual(MedicationNDC.objects.count(), 2)
+
+        out = io.StringIO()
+        with mock.patch.object(fetch_ndc_database.Command, "save_products", save_batches(None)):
+            with mock.patch("sys.stdout", out):
+                call_command("fetch_ndc_database", batch_size=2)
+        # the rows of the committed batch are not saved again
+        self.assertEqual(saved_batches, [["0001-0", "0001-1"], ["0001-2", "0001-3"]])
+        self.assertIn("Resuming the interrupted import after row 2", out.getvalue())
+        self.assert_imported_products()
+        self.assertFalse(ImportCheckpoint.objects.exists())
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_resume_other_archive(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+        ImportCheckpoint.objects.create(pk=1, archive_hash="other", rows=4, updated=timezone.now())
+
+        call_command("fetch_ndc_database", batch_size=2)
+        self.assert_imported_products()
+
+        # --no-resume imports the whole archive
+        archive_hash = fetch_ndc_database.get_file_sha256(fake_database_file())
+        ImportCheckpoint.objects.create(pk=1, archive_hash=archive_hash, rows=4, updated=timezone.now())
+        MedicationName.objects.all().delete()
+        call_command("fetch_ndc_database", batch_size=2, resume=False)
+        self.assert_imported_products()
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_rerun(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+
+        call_command("fetch_ndc_database", batch_size=3)
+        call_command("fetch_ndc_database", batch_size=2)
+        self.assertEqual(MedicationName.objects.count(), 2)
+        self.assertEqual(MedicationStrength.objects.count(), 4)
+        self.assertEqual(MedicationNDC.objects.count(), 4)
+        self.assert_imported_products()
+
+    @mock.patch("fdadb.management.commands.fetch_ndc_database.EsSearchAPI")
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_sync(self, fetch_database_file, es_search_api):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+        call_command("fetch_ndc_database", sync=True)
+        self.assert_imported_products()
+        fingerprints = dict(MedicationNDC.objects.values_list("ndc", "fingerprint"))
+        ndc_ids = dict(MedicationNDC.objects.values_list("ndc", "pk"))
+        self.assertTrue(all(fingerprints.values()))
+
+        # nothing changed, only the fingerprints are read
+        with self.assertNumQueries(1):
+            call_command("fetch_ndc_database", sync=True)
+        self.assertEqual(dict(MedicationNDC.objects.values_list("ndc", "fingerprint")), fingerprints)
+
+        # 0001-0 changes manufacturer, 0001-2 is withdrawn and 0001-5 is a new product
+        fetch_database_file.side_effect = fake_fetch_database_file(
+            replace=[
+                (b"20000101\t\tNDA\tNDA-A\tLabeler A", b"20000101\t\tNDA\tNDA-A\tLabeler C"),
+                (b"\t0001-2\t", b"\t0001-5\t"),
+            ]
+        )
+        with override_settings(TESTING=False, ELASTICSEARCH_URL="http://localhost:9200"):
+            call_command("fetch_ndc_database", sync=True)
+
+        self.assertEqual(
+            sorted(MedicationNDC.objects.values_list("ndc", "manufacturer")),
+            [("0001-0", "Labeler C"), ("0001-1", "Labeler A"), ("0001-3", "Labeler B"), ("0001-5", "Labeler B")],
+        )
+        self.assertEqual(MedicationNDC.objects.get(ndc="0001-0").pk, ndc_ids["0001-0"])
+        es = es_search_api.return_value
+        es.delete_medications.assert_called_once_with([], [], [ndc_ids["0001-2"]])
+        es.index_changed_medications.assert_called_once_with(
+            {"Drug A Suffix A", "Drug B Suffix B"},
+            {MedicationNDC.objects.get(ndc=ndc).medication_strength_id for ndc in ("0001-0", "0001-5")},
+            {"0001-0", "0001-5"},
+        )
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_sync_active_substances(self, fetch_database_file):
+        fetch_database_file.side_effect = fake_fetch_database_file()
+        call_command("fetch_ndc_database", sync=True, batch_size=1)
+
+        # the second product of Drug A does not define its active substances
+        fetch_database_file.side_effect = fake_fetch_database_file(
+            replace=[(b"Labeler A\tSubstance A\t40", b"Labeler A\tSubstance Y\t40")]
+        )
+        call_command("fetch_ndc_database", sync=True, batch_size=1)
+        self.assertEqual(MedicationName.objects.get(name="Drug A Suffix A").active_substances, ["Substance A"])
+
+        fetch_database_file.side_effect = fake_fetch_database_file(
+            replace=[(b"Labeler A\tSubstance A\t10", b"Labeler A\tSubstance X\t10")]
+        )
+        call_command("fetch_ndc_database", sync=True, batch_size=1)
+        self.assertEqual(MedicationName.objects.get(name="Drug A Suffix A").active_substances, ["Substance X"])
+        self.assertEqual(
+            MedicationName.objects.get(name="Drug B Suffix B").active_substances, ["Substance B-1", "Substance B-2"]
+        )
+
+    @mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+    def test_command_sync_repeated_ndc(self, fetch_database_file):
+        # 0001-0 is repeated by the second row, in another batch
+        fetch_database_file.side_effect = fake_fetch_database_file(replace=[(b"\t0001-1\t", b"\t0001-0\t")])
+        out = io.StringIO()
+        with mock.patch("sys.stdout", out):
+            call_command("fetch_ndc_database", sync=True, batch_size=1)
+        self.assertIn("3 inserted, 0 updated, 0 deleted", out.getvalue())
+        medication_ndc = MedicationNDC.objects.get(ndc="0001-0")
+        self.assertEqual(
+            medication_ndc.medication_strength.strength, {"Substance A": {"strength": "10", "unit": "mg/1"}}
+        )
+
+        # the first row is kept, nothing changes on the next synchronisations
+        for i in range(2):
+            out = io.StringIO()
+            with self.assertNumQueries(1), mock.patch("sys.stdout", out):
+                call_command("fetch_ndc_database", sync=True, batch_size=1)
+            self.assertIn("0 inserted, 0 updated, 0 deleted", out.getvalue())
+        self.assertEqual(MedicationNDC.objects.get(ndc="0001-0").fingerprint, medication_ndc.fingerprint)
+
+
+class ParseProductsTestCase(TestCase):
+    def test_parse_products(self):
+        row = {
+            "PRODUCTNDC": "0001-0",
+            "PROPRIETARYNAME": "Drug ",
+            "PROPRIETARYNAMESUFFIX": "XR",
+            "SUBSTANCENAME": "A; B",
+            "ACTIVE_NUMERATOR_STRENGTH": "1; 2",
+            "ACTIVE_INGRED_UNIT": "mg; g",
+            "LABELERNAME": "Labeler",
+            "NDC_EXCLUDE_FLAG": "N",
+        }
+        rows = [row, dict(row, LABELERNAME="Other"), dict(row, PRODUCTNDC="0001-1", NDC_EXCLUDE_FLAG="E")]
+
+        products, rows_count, skipped, seconds = parse_products(rows)
+        self.assertEqual((rows_count, skipped), (3, 1))
+        self.assertEqual(len(products), 1)
+        self.assertEqual(products[0].name, "Drug XR")
+        self.assertEqual(products[0].manufacturer, "Labeler")
+        self.assertEqual(
+            products[0].strength, {"A": {"strength": "1", "unit": "mg"}, "B": {"strength": "2", "unit": "g"}}
+        )
+        self.assertEqual(products[0].strength_hash, get_strength_hash(products[0].strength))
+
+    def test_strength_hash(self):
+        strength = OrderedDict([("A", {"strength": "1", "unit": "mg"}), ("B", {"unit": "g", "strength": "2"})])
+        self.assertEqual(
+            get_strength_hash(strength), get_strength_hash(OrderedDict(reversed(list(strength.items()))))
+        )
+        self.assertNotEqual(get_strength_hash(strength), get_strength_hash({"A": {"strength": "1", "unit": "mg"}}))
+
+
+class StagingImportTestCase(ImportedProductsMixin, TransactionTestCase):
+    def setUp(self):
+        cache_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(cache_dir.cleanup)
+        patcher = mock.patch.object(fetch_ndc_database, "FDADB_CACHE_DIR", cache_dir.name)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch.object(fetch_ndc_database.Command, "fetch_database_file")
+        patcher.start().side_effect = fake_fetch_database_file()
+        self.addCleanup(patcher.stop)
+
+    def assert_no_staging_tables(self):
+        tables = connection.introspection.table_names()
+        self.assertFalse([table for table in tables if table.endswith(fetch_ndc_database.STAGING_TABLE_SUFFIX)])
+
+    def test_command_staging(self):
+        MedicationName.objects.create(name="Withdrawn Drug", active_substances=[])
+
+        call_command("fetch_ndc_database", staging=True, batch_size=2)
+        self.assert_imported_products()
+        self.assert_no_staging_tables()
+
+        # the replaced tables keep their foreign keys
+        medication_strength = MedicationStrength.objects.first()
+        with self.assertRaises(IntegrityError), transaction.atomic():
+            MedicationStrengthIngredient.objects.create(
+                medication_strength_id=medication_strength.pk + 1000, substance="A", strength="1", unit="mg"
+            )
+        medication_strength.medication_name.delete()
+        self.assertFalse(MedicationNDC.objects.filter(medication_strength=medication_strength).exists())
+        strength_ids = dict(MedicationStrength.objects.values_list("strength_hash", "pk"))
+        ndc_ids = dict(MedicationNDC.objects.values_list("ndc", "pk"))
+        last_strength_id, last_ndc_id = max(strength_ids.values()), max(ndc_ids.values())
+
+        call_command("fetch_ndc_database", staging=True, force=True)
+        self.assert_imported_products()
+        self.assert_no_staging_tables()
+
+        # saved medications keep their ids, the deleted ones are saved again with ids after them
+        for strength_hash, pk in MedicationStrength.objects.values_list("strength_hash", "pk"):
+            self.assertEqual(pk, strength_ids.get(strength_hash, pk))
+            self.assertTrue(strength_hash in strength_ids or pk > last_strength_id)
+        for ndc, pk in MedicationNDC.objects.values_list("ndc", "pk"):
+            self.assertEqual(pk, ndc_ids.get(ndc, pk))
+            self.assertTrue(ndc in ndc_ids or pk > last_ndc_id)
+        self.assertLess(len(ndc_ids), MedicationNDC.objects.count())
+        new_ndc = MedicationNDC.objects.create(
+            ndc="new", manufacturer="M", fingerprint="", medication_strength=MedicationStrength.objects.first()
+        )
+        self.assertGreater(new_ndc.pk, MedicationNDC.objects.exclude(pk=new_ndc.pk).aggregate(Max("pk"))["pk__max"])
+
+    @mock.patch.object(connection.ops, "max_name_length", return_value=63)
+    def test_command_staging_long_index_names(self, max_name_length):
+        # names are shortened to the PostgreSQL limit and do not all contain the staging table name
+        call_command("fetch_ndc_database", staging=True)
+        call_command("fetch_ndc_database", staging=True, force=True)
+        self.assert_imported_products()
+        self.assert_no_staging_tables()
+
+        with connection.schema_editor(collect_sql=True) as schema_editor:
+            for model in fetch_ndc_database.IMPORT_MODELS:
+                schema_editor.create_model(model)
+        index_names = set(re.findall(r'INDEX "(\w+)"', "\n".join(schema_editor.collected_sql)))
+        self.assertTrue(any(len(name) == 63 for name in index_names))
+        names = set()
+        with connection.cursor() as cursor:
+            for model in fetch_ndc_database.IMPORT_MODELS:
+                names.update(connection.introspection.get_constraints(cursor, model._meta.db_table))
+        self.assertLessEqual(index_names, names)
+
+    def test_command_staging_failed(self):
+        MedicationName.objects.create(name="Drug", active_substances=[])
+
+        with mock.patch.object(fetch_ndc_database.Command, "save_ndcs", side_effect=ValueError):
+            with self.assertRaises(ValueError):
+                call_command("fetch_ndc_database", staging=True)
+        self.assertEqual(list(MedicationName.objects.values_list("name", flat=True)), ["Drug"])
+        self.assert_no_staging_tables()
+
+    def test_command_staging_validation(self):
+        with mock.patch.object(fetch_ndc_database.Command, "save_ndcs"):
+            with self.assertRaisesRegex(Exception, "Staging tables do not contain the saved products"):
+                call_command("fetch_ndc_database", staging=True)
+        self.assertEqual(MedicationName.objects.count(), 0)
+        self.assert_no_staging_tables()
+
+    def test_command_staging_sync(self):
+        with self.assertRaises(CommandError):
+            call_command("fetch_ndc_database", staging=True, sync=True)
@@ -0,0 +1,45 @@
+from importlib import import_module
+
+from django.apps import apps
+from django.test import TestCase
+
+from fdadb.models import MedicationName, MedicationNDC, MedicationStrength, MedicationStrengthIngredient
+from fdadb.ndc_parser import get_strength_hash
+
+strength_hash_migration = import_module("fdadb.migrations.0007_medicationstrength_strength_hash")
+
+
+class StrengthHashMigrationTestCase(TestCase):
+    def test_backfill_strength_hashes(self):
+        medication_name = MedicationName.objects.create(name="Drug", active_substances=["A", "B"])
+        strength = {"A": {"strength": "1", "unit": "mg"}, "B": {"strength": "2", "unit": "g"}}
+        reordered_strength = {"B": {"unit": "g", "strength": "2"}, "A": {"unit": "mg", "strength": "1"}}
+        # strengths saved before the hash existed, the same strength twice
+        MedicationStrength.objects.bulk_create(
+            [
+                MedicationStrength(medication_name=medication_name, strength=strength, strength_hash="1"),
+                MedicationStrength(medication_name=medication_name, strength=reordered_strength, strength_hash="2"),
+                MedicationStrength(medication_name=medication_name, strength={"A": strength["A"]}, strength_hash="3"),
+            ]
+        )
+        strengths = list(MedicationStrength.objects.order_by("pk"))
+        for i, medication_strength in enumerate(strengths):
+            MedicationNDC.objects.create(medication_strength=medication_strength, ndc=str(i), manufacturer="M")
+            MedicationStrengthIngredient.objects.create(
+                medication_strength=medication_strength, substance="A", strength="1", unit="mg"
+            )
+
+        strength_hash_migration.backfill_strength_hashes(apps, None)
+
+        self.assertEqual(
+            list(MedicationStrength.objects.order_by("pk").values_list("pk", "strength_hash")),
+            [
+                (strengths[0].pk, get_strength_hash(strength)),
+                (strengths[2].pk, get_strength_hash({"A": strength["A"]})),
+            ],
+        )
+        self.assertEqual(
+            list(MedicationNDC.objects.order_by("ndc").values_list("ndc", "medication_strength_id")),
+            [("0", strengths[0].pk), ("1", strengths[0].pk), ("2", strengths[2].pk)],
+        )
+        self.assertEqual(MedicationStrengthIngredient.objects.count(), 2)
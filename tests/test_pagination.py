@@ -0,0 +1,31 @@
+from unittest import mock
+
+from django.test import TestCase
+
+from fdadb.pagination import EsSearchResults
+
+
+def fake_search(total):
+    return mock.Mock(side_effect=lambda offset, size: (total, list(range(offset, min(offset + size, total)))))
+
+
+class EsSearchResultsTestCase(TestCase):
+    def test_window(self):
+        search = fake_search(25)
+        results = EsSearchResults(search)
+        results.set_window(20, 10)
+        self.assertEqual(results.count(), 25)
+        self.assertEqual(results[20:25], [20, 21, 22, 23, 24])
+        search.assert_called_once_with(20, 10)
+
+    def test_other_slice(self):
+        search = fake_search(25)
+        results = EsSearchResults(search)
+        self.assertEqual(len(results), 25)
+        self.assertEqual(results[5:8], [5, 6, 7])
+        self.assertEqual(results[2], 2)
+        self.assertEqual(search.call_count, 3)
+
+    def test_iter(self):
+        results = EsSearchResults(fake_search(3), size=2)
+        self.assertEqual(list(results), [0, 1])
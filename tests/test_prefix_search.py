@@ -0,0 +1,66 @@
+from unittest import mock
+
+from django.test import TestCase
+from rest_framework.reverse import reverse
+from rest_framework.test import APITestCase
+
+from fdadb.cache import invalidate_autocomplete_cache
+from fdadb.models import MedicationName
+from fdadb.prefix_search import PrefixSearchIndex, get_prefix_search_index, search_names
+
+NAMES = ["Viagra", "Aspirin Low Dose", "Baby Aspirin", "Amitriptyline HCl", "Ami-Lac", "Zinc Amino Acid"]
+
+
+class PrefixSearchIndexTestCase(TestCase):
+    def setUp(self):
+        self.index = PrefixSearchIndex(NAMES)
+
+    def test_search_prefix(self):
+        self.assertEqual(self.index.search("ami"), ["Ami-Lac", "Amitriptyline HCl", "Zinc Amino Acid"])
+        self.assertEqual(self.index.search("AMIT"), ["Amitriptyline HCl"])
+        self.assertEqual(self.index.search("ami", limit=2), ["Ami-Lac", "Amitriptyline HCl"])
+        self.assertEqual(self.index.search("xyz"), [])
+
+    def test_search_words(self):
+        self.assertEqual(self.index.search("aspirin"), ["Aspirin Low Dose", "Baby Aspirin"])
+        self.assertEqual(self.index.search("asp dos"), ["Aspirin Low Dose"])
+        self.assertEqual(self.index.search("low aspirin"), ["Aspirin Low Dose"])
+        self.assertEqual(self.index.search("aspirin baby"), ["Baby Aspirin"])
+
+    def test_search_empty(self):
+        self.assertEqual(self.index.search("", limit=3), ["Ami-Lac", "Amitriptyline HCl", "Aspirin Low Dose"])
+        self.assertEqual(len(self.index), len(NAMES))
+
+
+@mock.patch("fdadb.api.NAME_SEARCH_BACKEND", "memory")
+class PrefixSearchAPITestCase(APITestCase):
+    def setUp(self):
+        for name in NAMES:
+            MedicationName.objects.create(name=name, active_substances=[name + " Substance"])
+        invalidate_autocomplete_cache()
+
+    def test_names_api(self):
+        url = reverse("fdadb-medications-names")
+        response = self.client.get(url + "?q=ami")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            [item["name"] for item in response.data["results"]], ["Ami-Lac", "Amitriptyline HCl", "Zinc Amino Acid"]
+        )
+        self.assertEqual(response.data["results"][0]["active_substances"], ["Ami-Lac Substance"])
+
+    def test_search_names(self):
+        search_names("zinc")
+        # the index keeps the active substances, searches do not query the database
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                search_names("ami", limit=1), [{"name": "Ami-Lac", "active_substances": ["Ami-Lac Substance"]}]
+            )
+
+    def test_index_rebuilt(self):
+        index = get_prefix_search_index()
+        self.assertIs(get_prefix_search_index(), index)
+
+        MedicationName.objects.create(name="Amiodarone", active_substances=["Amiodarone"])
+        invalidate_autocomplete_cache()
+        self.assertIsNot(get_prefix_search_index(), index)
+        self.assertEqual(get_prefix_search_index().search("amio"), ["Amiodarone"])
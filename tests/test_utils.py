@@ -4,5 +4,14 @@ from rest_framework.test import APITestCase
 UserModel = get_user_model()
 
 
-class BaseTestCase(APITestCase):
+class QueryCountMixin(object):
+    def assertEndpointQueries(self, url, num, status_code=200):
+        """Request the endpoint and check it ran exactly `num` database queries, whatever the size of the page"""
+        with self.assertNumQueries(num):
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, status_code)
+        return response
+
+
+class BaseTestCase(QueryCountMixin, APITestCase):
     pass